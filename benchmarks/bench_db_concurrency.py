@@ -0,0 +1,64 @@
+"""Throughput of concurrent queries issued from the event loop: sync Session against AsyncSession.
+
+Each simulated request runs one query that takes --delay seconds on the server (pg_sleep), so a blocking
+driver serializes the requests while the async driver overlaps them.
+Usage: python benchmarks/bench_db_concurrency.py [--requests 500] [--concurrency 50] [--delay 0.005]
+"""
+import argparse
+import asyncio
+import time
+from bench_utils import add_src_to_path, summarize
+
+add_src_to_path()
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from config import settings
+
+QUERY = text("SELECT pg_sleep(:delay)")
+
+
+async def run(name:str, handler, requests:int, concurrency:int):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one_request():
+        async with semaphore:
+            start = time.perf_counter()
+            await handler()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    summarize(name, samples)
+    print(f"{'':<40} {requests / elapsed:.1f} req/s over {elapsed:.2f}s")
+
+async def main(requests:int, concurrency:int, delay:float):
+    sync_engine = create_engine(settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW)
+    async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW)
+    async_session = async_sessionmaker(bind=async_engine)
+
+    async def sync_handler():
+        # what the routers did before: a blocking Session called from an async def route
+        with Session(sync_engine) as db:
+            db.execute(QUERY, {"delay": delay})
+
+    async def async_handler():
+        async with async_session() as db:
+            await db.execute(QUERY, {"delay": delay})
+
+    await run("sync Session (before)", sync_handler, requests, concurrency)
+    await run("AsyncSession (after)", async_handler, requests, concurrency)
+    sync_engine.dispose()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
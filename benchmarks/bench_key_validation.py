@@ -0,0 +1,75 @@
+"""Latency of the key validation lookup through the async engine: the old path (mask lookup, then the salt
+through hmac_keys and a freshly keyed HMAC) against what get_api_key_details runs now (the key_id lookup joined
+to the owner's tier, the salt from the in-memory keyring and a copy of its pre-keyed HMAC).
+
+Runs against the database configured in src/.env and needs projects created after the key_id and
+salt_version_id migrations. The presented keys are made up around each row's key id, so both paths do all
+the work of a valid key and only the final hash comparison fails.
+Usage: python benchmarks/bench_key_validation.py [iterations]
+"""
+import asyncio
+import sys
+import time
+from bench_utils import add_src_to_path, summarize
+
+add_src_to_path()
+
+from sqlalchemy import select, and_
+import models
+from utils.keygeneration import hash_with_hmac
+from utils.salt_keyring import salt_keyring
+from routers.project_services import load_candidates, verify_candidates
+
+BEFORE = "mask + hmac_keys join (before)"
+AFTER = "key_id + tier join, keyring (after)"
+
+
+async def two_query_path(db, api_key:str, msecret_key:str) -> bool:
+    # what get_api_key_details did before the key_id index and the keyring
+    api_details = (await db.execute(select(models.ProjectDetails).filter_by(msecret_key=msecret_key))).scalars().first()
+    _, _, key_value = (await db.execute(select(models.HmacKeys.hmac_version, models.SaltVersion.version_name, models.SaltVersion.key_value).join(
+        models.SaltVersion, models.HmacKeys.hmac_version == models.SaltVersion.version_name
+        ).filter(models.HmacKeys.project_id == api_details.project_id))).first()
+    return await hash_with_hmac(api_key=api_key, salt=key_value) == api_details.secret_key_hash
+
+async def key_id_path(db, api_key:str, key_id:str) -> bool:
+    # the statement and the salt lookup of get_api_key_details, without its result cache
+    candidates, salt_version_names = await load_candidates(models.ProjectDetails.key_id == key_id, db)
+    result, _ = await verify_candidates(api_key, candidates, salt_version_names)
+    return result["status"] == "valid"
+
+async def main(iterations:int):
+    await salt_keyring.refresh()
+    async with models.get_sessionmaker()() as db:
+        rows = (await db.execute(select(models.ProjectDetails.key_id, models.ProjectDetails.msecret_key).join(
+            models.HmacKeys, models.HmacKeys.project_id == models.ProjectDetails.project_id
+            ).filter(and_(models.ProjectDetails.key_id.isnot(None), models.ProjectDetails.salt_version_id.isnot(None))).limit(100))).all()
+        if not rows:
+            print("no projects with key_id and salt_version_id found, create a few projects first")
+            return
+        keys = [(f"ak-dev-bench-{key_id}.not-the-real-token", key_id, msecret_key) for key_id, msecret_key in rows]
+        # warm up the pool and the plan cache for both paths
+        for api_key, key_id, msecret_key in keys:
+            await two_query_path(db, api_key, msecret_key)
+            await key_id_path(db, api_key, key_id)
+            db.expunge_all()
+
+        results = {BEFORE: [], AFTER: []}
+        for i in range(iterations):
+            api_key, key_id, msecret_key = keys[i % len(keys)]
+            start = time.perf_counter()
+            await two_query_path(db, api_key, msecret_key)
+            results[BEFORE].append(time.perf_counter() - start)
+            db.expunge_all()
+
+            start = time.perf_counter()
+            await key_id_path(db, api_key, key_id)
+            results[AFTER].append(time.perf_counter() - start)
+            db.expunge_all()
+    await models.get_engine().dispose()
+    for name, samples in results.items():
+        summarize(name, samples)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
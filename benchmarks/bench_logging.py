@@ -0,0 +1,76 @@
+"""Per call cost of a log statement on the request path: handlers called inline against the queue handler.
+
+Both setups write the same lines to a stream and a rotating file in a temp directory, only the time spent
+in the logging call itself is measured, the listener thread does its formatting and I/O off that path.
+Usage: python benchmarks/bench_logging.py [--calls 20000] [--rate 20]
+"""
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler, QueueListener
+from bench_utils import add_src_to_path, summarize
+
+add_src_to_path()
+
+from utils.logger import NonBlockingQueueHandler, SamplingFilter, make_formatter
+
+HOT_LOGGER = "bench.hot_path"
+
+
+def make_handlers(directory:str, log_format:str):
+    formatter = make_formatter(log_format)
+    stream = open(os.path.join(directory, "stdout.log"), "a", encoding="utf-8")
+    handlers = [logging.StreamHandler(stream), RotatingFileHandler(os.path.join(directory, "app.log"), maxBytes=10000000, backupCount=5, encoding="utf-8")]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def measure(name:str, calls:int, root_handlers:list, listener = None, sample_rate:int = 0):
+    root = logging.getLogger()
+    root.handlers = root_handlers
+    root.setLevel(logging.INFO)
+    hot = logging.getLogger(HOT_LOGGER)
+    hot.filters = [SamplingFilter(sample_rate)] if sample_rate else []
+    if listener is not None:
+        listener.start()
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        hot.info("Custom limiter - Key: %s, Remaining: %d, Limit: %d", f"ratelimit:catalog:ip_10.0.0.{i % 250}", i % 30, 30)
+        samples.append(time.perf_counter() - start)
+    summarize(name, samples, unit="us")
+    if listener is not None:
+        drain_start = time.perf_counter()
+        listener.stop()
+        print(f"{'':<40} listener drained in {(time.perf_counter() - drain_start) * 1000:.1f}ms, "
+              f"queue dropped {root_handlers[0].dropped}")
+    if sample_rate:
+        print(f"{'':<40} sampling dropped {hot.filters[0].dropped_total} of {calls}")
+    for handler in (listener.handlers if listener is not None else root_handlers):
+        handler.close()
+    root.handlers = []
+
+def queued(directory:str, log_format:str, queue_size:int):
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, *make_handlers(directory, log_format), respect_handler_level=True)
+    return [NonBlockingQueueHandler(log_queue)], listener
+
+def main(calls:int, rate:int, queue_size:int):
+    with tempfile.TemporaryDirectory() as directory:
+        for log_format in ("text", "json"):
+            # before: every call formats the record and writes both handlers on the caller's thread
+            measure(f"inline handlers ({log_format})", calls, make_handlers(directory, log_format))
+            measure(f"queue handler ({log_format})", calls, *queued(directory, log_format, queue_size))
+            measure(f"queue handler + sampling ({log_format})", calls, *queued(directory, log_format, queue_size), sample_rate=rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--rate", type=int, default=20, help="records per second let through by the sampling filter")
+    parser.add_argument("--queue-size", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.calls, args.rate, args.queue_size)
@@ -0,0 +1,163 @@
+"""Per-request overhead of the CSRF and rate limit middleware, driven straight through ASGI (no server, no socket).
+
+Compares a bare app, the same app behind the old BaseHTTPMiddleware RateLimitMiddleware + CSRFMiddleware (copied
+below as they were, INCR/EXPIRE on an in-memory counter instead of Redis) and the app behind the ASGI
+RateLimitMiddleware + CSRFMiddleware with the in-memory limiter, so only middleware cost is measured.
+Usage: python benchmarks/bench_middleware.py [iterations]
+"""
+import asyncio
+import sys
+import time
+from bench_utils import add_src_to_path, summarize
+
+add_src_to_path()
+
+import secrets
+from fastapi import FastAPI, Request, HTTPException, status
+from fastapi.responses import JSONResponse
+from fastapi_limiter import FastAPILimiter
+from starlette.middleware.base import BaseHTTPMiddleware
+from utils.limiter import MemoryRateLimiter
+from utils.logger import logger
+from utils.middleware import CSRFMiddleware, RateLimitMiddleware
+from utils.rate_limit import rate_limit_key
+
+CSRF_TOKEN = "a" * 64
+MESSAGE_LIMIT = 30
+TIME_LIMIT = 60
+
+
+class CounterRedis:
+    """INCR and EXPIRE in memory, the old rate limit middleware awaited FastAPILimiter.redis on every request"""
+
+    def __init__(self):
+        self.counts = {}
+
+    async def _ready(self):
+        return self
+
+    def __await__(self):
+        return self._ready().__await__()
+
+    async def incr(self, key:str) -> int:
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return self.counts[key]
+
+    async def expire(self, key:str, seconds:int):
+        return True
+
+
+class OldCSRFMiddleware(BaseHTTPMiddleware):
+    """CSRFMiddleware before the move to plain ASGI"""
+    def __init__(self, app, csrf_token_cookie_name:str = "csrf_token", csrf_token_header_name:str = "X-CSRF-Token"):
+        super().__init__(app)
+        self.csrf_token_cookie_name = csrf_token_cookie_name
+        self.csrf_token_header_name = csrf_token_header_name
+
+    async def dispatch(self, request:Request, call_next):
+        if request.method.upper() in ["GET", "HEAD", "OPTIONS"]:
+            response = await call_next(request)
+            if self.csrf_token_cookie_name not in request.cookies:
+                csrf_token = secrets.token_hex(32)
+                response.set_cookie(key=self.csrf_token_cookie_name, value=csrf_token, httponly=False, samesite="lax", path="/")
+                logger.info(f"New CSRF token generated for request to {request.url.path}")
+            return response
+        elif request.method.upper() in ["POST", "PUT", "DELETE", "PATCH"]:
+            csrf_cookie = request.cookies.get(self.csrf_token_cookie_name)
+            csrf_header = request.headers.get(self.csrf_token_header_name)
+            if request.url.path in ["/api/v1/login", "/api/v1/registration", "/api/v1/auth/callback", "/api/v1/auth/jira/callback"]:
+                return await call_next(request)
+            if not csrf_cookie or not csrf_header or csrf_cookie != csrf_header:
+                logger.warning(f"CSRF validation failed for {request.url.path} - Cookie: {csrf_cookie}, Header: {csrf_header}")
+                raise HTTPException(status_code=403, detail="CSRF token missing or invalid")
+            return await call_next(request)
+        return await call_next(request)
+
+
+class OldRateLimitMiddleware(BaseHTTPMiddleware):
+    """RateLimitMiddleware before the move to plain ASGI and the GCRA limiter"""
+    async def dispatch(self, request:Request, call_next):
+        if request.method.upper() == "OPTIONS" or request.url.path in ["/health", "/metrics"]:
+            return await call_next(request)
+        logger.info(f"request in ratelimitmiddleware: {request.headers}")
+        try:
+            redis = await FastAPILimiter.redis
+            key = await rate_limit_key(request)
+            full_key = f"{FastAPILimiter.prefix}{key}"
+            current = await redis.incr(full_key)
+            if current == 1:
+                await redis.expire(full_key, TIME_LIMIT)
+            if current > MESSAGE_LIMIT:
+                logger.warning(f"Rate limit exceeded for {key}")
+                return JSONResponse(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    content={"error": "rate_limit_exceeded", "message": "Too many requests"},
+                    headers={"Retry-After": "60"}
+                )
+            return await call_next(request)
+        except Exception as e:
+            logger.error(f"Rate limit error: {e}")
+            return await call_next(request)
+
+
+def build_app(middleware:list) -> FastAPI:
+    app = FastAPI()
+    app.state.rate_limiter = MemoryRateLimiter()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.post("/ping")
+    async def ping_post():
+        return {"ok": True}
+
+    for middleware_class in middleware:
+        app.add_middleware(middleware_class)
+    return app
+
+def make_scope(method:str, client:int) -> dict:
+    headers = [
+        (b"host", b"bench"),
+        (b"user-agent", b"bench-middleware"),
+        (b"cookie", f"csrf_token={CSRF_TOKEN}".encode()),
+        (b"x-csrf-token", CSRF_TOKEN.encode()),
+    ]
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": "/ping", "raw_path": b"/ping", "root_path": "", "query_string": b"", "headers": headers,
+        "client": (f"198.51.{client // 256 % 256}.{client % 256}", 50000), "server": ("bench", 80),
+    }
+
+async def call(app, method:str, client:int):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message["status"]
+
+    await app(make_scope(method, client), receive, send)
+
+async def run(name:str, app, iterations:int):
+    for method in ("GET", "POST"):
+        for i in range(200):
+            await call(app, method, i)
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            # a different client per request so the quota is never hit
+            await call(app, method, i)
+            samples.append(time.perf_counter() - start)
+        summarize(f"{name} {method}", samples, unit="us")
+
+async def main(iterations:int):
+    FastAPILimiter.redis = CounterRedis()
+    FastAPILimiter.prefix = "fastapi-limiter:"
+    await run("no middleware", build_app([]), iterations)
+    await run("BaseHTTP rate limit + CSRF (before)", build_app([OldRateLimitMiddleware, OldCSRFMiddleware]), iterations)
+    await run("ASGI rate limit + CSRF (after)", build_app([RateLimitMiddleware, CSRFMiddleware]), iterations)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,84 @@
+"""Login callback throughput against the local mock identity provider: the old blocking token exchange and
+user info calls (a blocking httpx.Client, inside the event loop) against the pooled httpx.AsyncClient.
+
+Starts src/mock_idp.py on --port with --delay seconds of latency per call, no Google account needed.
+Usage: python benchmarks/bench_oauth_callback.py [--logins 200] [--concurrency 50] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+from bench_utils import add_src_to_path, summarize
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--logins", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=50)
+parser.add_argument("--delay", type=float, default=0.05)
+parser.add_argument("--port", type=int, default=8090)
+args = parser.parse_args()
+
+# has to be set before the app modules read their settings
+BASE_URL = f"http://127.0.0.1:{args.port}"
+os.environ["MOCK_IDP_DELAY_SECONDS"] = str(args.delay)
+os.environ["OAUTH_AUTH_URI"] = f"{BASE_URL}/authorize"
+os.environ["OAUTH_TOKEN_URI"] = f"{BASE_URL}/token"
+os.environ["OAUTH_USERINFO_URI"] = f"{BASE_URL}/userinfo"
+os.environ.setdefault("OAUTH_CLIENT_SECRETS_FILE", "missing.json")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench-client")
+os.environ.setdefault("OAUTH_CLIENT_SECRET", "bench-secret")
+add_src_to_path()
+
+import httpx
+import uvicorn
+import mock_idp
+from oauth import auth_callback, get_client_config
+
+
+def start_mock_idp() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(mock_idp.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def mint_codes(count:int) -> list:
+    with httpx.Client(base_url=BASE_URL) as client:
+        return [client.post("/mint", data={"email": f"bench-{i}@example.com"}).json()["code"] for i in range(count)]
+
+async def blocking_callback(code:str):
+    # what oauth.auth_callback did before: blocking calls straight from the async route
+    client_config = get_client_config()
+    with httpx.Client() as client:
+        token = client.post(client_config["token_uri"], data={"code": code}).json()["access_token"]
+        client.get(client_config["userinfo_uri"], headers={"Authorization": f"Bearer {token}"}).json()
+
+async def run(name:str, handler, codes:list):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    samples = []
+
+    async def one_login(code:str):
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(code)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_login(code) for code in codes))
+    elapsed = time.perf_counter() - start
+    summarize(name, samples)
+    print(f"{'':<40} {len(codes) / elapsed:.1f} logins/s over {elapsed:.2f}s")
+
+async def main():
+    await run("blocking httpx.Client (before)", blocking_callback, mint_codes(args.logins))
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)) as client:
+        async def async_callback(code:str):
+            response = await auth_callback(client, url=f"http://app/callback?code={code}&state=bench")
+            assert response["message"] == "Authentication successful", response
+        await run("pooled httpx.AsyncClient (after)", async_callback, mint_codes(args.logins))
+
+
+if __name__ == "__main__":
+    server = start_mock_idp()
+    asyncio.run(main())
+    server.should_exit = True
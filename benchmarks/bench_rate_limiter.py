@@ -0,0 +1,65 @@
+"""Requests/sec and Redis ops/sec of the rate limiters: one GCRA script per check against the hybrid
+limiter that decides locally and syncs counts in batches.
+
+Needs the Redis configured in src/.env. Redis ops are read from INFO total_commands_processed, so run it
+against an otherwise idle Redis. Limits are set high enough that every request is allowed, the common case.
+Usage: python benchmarks/bench_rate_limiter.py [--requests 20000] [--concurrency 100] [--keys 50]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from bench_utils import add_src_to_path, summarize
+
+add_src_to_path()
+
+from redis.asyncio import Redis
+from config import settings
+from utils.limiter import RedisRateLimiter, HybridRateLimiter
+
+
+async def commands_processed(redis) -> int:
+    return int((await redis.info("stats"))["total_commands_processed"])
+
+async def run(name:str, limiter, redis, requests:int, concurrency:int, keys:int):
+    prefix = f"bench-limiter:{uuid.uuid4().hex}:"
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one_request(i:int):
+        async with semaphore:
+            start = time.perf_counter()
+            await limiter.hit(f"{prefix}{i % keys}", 1_000_000, 60)
+            samples.append(time.perf_counter() - start)
+
+    commands_before = await commands_processed(redis)
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(requests)))
+    if isinstance(limiter, HybridRateLimiter):
+        await limiter.stop()
+    elapsed = time.perf_counter() - start
+    # minus the INFO call itself
+    commands = await commands_processed(redis) - commands_before - 1
+    summarize(name, samples, unit="us")
+    print(f"{'':<40} {requests / elapsed:.0f} req/s, {commands / elapsed:.0f} redis ops/s, "
+          f"{commands / requests:.3f} redis ops per request")
+
+async def main(requests:int, concurrency:int, keys:int, sync_interval_ms:int, overshoot:float):
+    redis = Redis(host=settings.REDIS_HOST, port=int(settings.REDIS_PORT), decode_responses=True)
+    await redis.ping()
+    await run("redis GCRA script (before)", RedisRateLimiter(redis), redis, requests, concurrency, keys)
+    hybrid = HybridRateLimiter(redis, sync_interval=sync_interval_ms / 1000, overshoot=overshoot)
+    hybrid.start()
+    await run(f"hybrid, sync every {sync_interval_ms}ms (after)", hybrid, redis, requests, concurrency, keys)
+    await redis.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--sync-interval-ms", type=int, default=50)
+    parser.add_argument("--overshoot", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.keys, args.sync_interval_ms, args.overshoot))
@@ -0,0 +1,30 @@
+import os
+import statistics
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+def add_src_to_path():
+    """Benchmarks import the app modules the same way uvicorn does when started from src/"""
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+
+def percentile(samples:list, pct:float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(name:str, samples:list, unit:str = "ms") -> dict:
+    """Prints one result line for latency samples given in seconds"""
+    scale = 1000 if unit == "ms" else 1_000_000
+    summary = {
+        "name": name,
+        "n": len(samples),
+        "mean": statistics.fmean(samples) * scale,
+        "p50": percentile(samples, 50) * scale,
+        "p95": percentile(samples, 95) * scale,
+        "p99": percentile(samples, 99) * scale,
+    }
+    print(f"{name:<40} n={summary['n']:<7} mean={summary['mean']:.3f}{unit} p50={summary['p50']:.3f}{unit} "
+          f"p95={summary['p95']:.3f}{unit} p99={summary['p99']:.3f}{unit}")
+    return summary
@@ -6,12 +6,28 @@ class Settings:
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_TOKEN =  os.getenv("GOOGLE_CLIENT_TOKEN")
     REDIRECT_URL = os.getenv("REDIRECT_URL")
+    OAUTH_CLIENT_SECRETS_FILE = os.getenv("OAUTH_CLIENT_SECRETS_FILE", "../client_secret_g.json")
+    OAUTH_CLIENT_SECRET = os.getenv("OAUTH_CLIENT_SECRET")
+    # empty means the endpoints of the client secrets file, point them at mock_idp.py for tests and benchmarks
+    OAUTH_AUTH_URI = os.getenv("OAUTH_AUTH_URI")
+    OAUTH_TOKEN_URI = os.getenv("OAUTH_TOKEN_URI")
+    OAUTH_USERINFO_URI = os.getenv("OAUTH_USERINFO_URI", "https://www.googleapis.com/oauth2/v2/userinfo")
     POSTGRES_USER = os.getenv("POSTGRES_USER")
     POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
     POSTGRES_DB = os.getenv("POSTGRES_DB")
     POSTGRES_PORT = os.getenv("POSTGRES_PORT")
     POSTGRES_HOSTNAME = os.getenv("POSTGRES_HOSTNAME")
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # connections older than this are replaced on checkout
+    # off by default, python migrate.py applies schema changes once per deploy
+    RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "false").lower() == "true"
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # connections opened at startup, off by default so a new replica is ready without waiting on the DB
+    DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", "0"))
     ALGORITHM=os.getenv("ALGORITHM")
     SECRET_KEY_J=os.getenv("SECRET_KEY_J")
     TOKEN_EXPIRED_TIME_IN_DAYS=os.getenv("TOKEN_EXPIRED_TIME_IN_DAYS")
@@ -24,6 +40,57 @@ class Settings:
     REDIS_PORT = os.getenv("REDIS_PORT")
     # REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
     REDIS_SSL = os.getenv("REDIS_SSL")
+    OAUTH_STATE_TTL_SECONDS = int(os.getenv("OAUTH_STATE_TTL_SECONDS", "600"))
+    API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+    API_KEY_CACHE_TTL_SECONDS = float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "60"))
+    API_KEY_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("API_KEY_CACHE_NEGATIVE_TTL_SECONDS", "5"))
+    API_KEY_BATCH_MAX_SIZE = int(os.getenv("API_KEY_BATCH_MAX_SIZE", "100"))
+    PROJECT_BULK_MAX_SIZE = int(os.getenv("PROJECT_BULK_MAX_SIZE", "500"))
+    HTTP_CLIENT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CLIENT_TIMEOUT_SECONDS", "10"))
+    HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS", "3"))
+    HTTP_CLIENT_MAX_CONNECTIONS = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "100"))
+    HTTP_CLIENT_MAX_KEEPALIVE = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "20"))
+    # set when running several workers, each one shares its metrics through a snapshot file in this directory
+    METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR")
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # per request loggers, each one lets at most LOG_SAMPLE_RATE_PER_SECOND info records through per second
+    LOG_SAMPLED_LOGGERS = [name.strip() for name in os.getenv("LOG_SAMPLED_LOGGERS", "utils.rate_limit,utils.middleware,utils.token_generation,routers.authentication").split(",") if name.strip()]
+    LOG_SAMPLE_RATE_PER_SECOND = int(os.getenv("LOG_SAMPLE_RATE_PER_SECOND", "20"))
+    TIER_CACHE_SIZE = int(os.getenv("TIER_CACHE_SIZE", "50000"))
+    # tiers are shared between workers in Redis for TIER_CACHE_TTL_SECONDS, a changed tier applies after at most that long
+    TIER_CACHE_TTL_SECONDS = float(os.getenv("TIER_CACHE_TTL_SECONDS", "300"))
+    TIER_LOCAL_TTL_SECONDS = float(os.getenv("TIER_LOCAL_TTL_SECONDS", "10"))
+    JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+    JWT_CACHE_MAX_TTL_SECONDS = float(os.getenv("JWT_CACHE_MAX_TTL_SECONDS", "3600"))
+    PASSWORD_POOL_KIND = os.getenv("PASSWORD_POOL_KIND", "thread")
+    PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "64"))
+    SALT_KEYRING_REFRESH_SECONDS = float(os.getenv("SALT_KEYRING_REFRESH_SECONDS", "60"))
+    # unknown salt versions reload the keyring at most this often
+    SALT_KEYRING_MIN_RELOAD_SECONDS = float(os.getenv("SALT_KEYRING_MIN_RELOAD_SECONDS", "5"))
+    RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "hybrid")  # hybrid or redis
+    RATE_LIMIT_SYNC_INTERVAL_MS = int(os.getenv("RATE_LIMIT_SYNC_INTERVAL_MS", "50"))
+    RATE_LIMIT_ALLOWED_OVERSHOOT = float(os.getenv("RATE_LIMIT_ALLOWED_OVERSHOOT", "0.1"))
+    # workers sharing the Redis counters, the hybrid limiter splits the allowed overshoot between them
+    RATE_LIMIT_WORKERS = int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+    REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "0.25"))
+    RATE_LIMIT_BREAKER_FAILURES = int(os.getenv("RATE_LIMIT_BREAKER_FAILURES", "5"))
+    RATE_LIMIT_BREAKER_RESET_SECONDS = float(os.getenv("RATE_LIMIT_BREAKER_RESET_SECONDS", "5"))
+    RATE_LIMIT_BREAKER_CALL_TIMEOUT_MS = int(os.getenv("RATE_LIMIT_BREAKER_CALL_TIMEOUT_MS", "100"))
+    # the middleware is what applies the limiter, every route except the exempt ones is limited by default
+    RATE_LIMIT_MIDDLEWARE_ENABLED = os.getenv("RATE_LIMIT_MIDDLEWARE_ENABLED", "true").lower() == "true"
+    CSRF_MIDDLEWARE_ENABLED = os.getenv("CSRF_MIDDLEWARE_ENABLED", "false").lower() == "true"
+    PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+    PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "200"))
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "postgres")  # postgres or memory when pg_trgm is not available
+    CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+    CATALOG_CACHE_LOCK_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_LOCK_TTL_SECONDS", "5"))
+    CATALOG_CACHE_LOCK_WAIT_SECONDS = float(os.getenv("CATALOG_CACHE_LOCK_WAIT_SECONDS", "0.2"))
 
 
 
@@ -1,16 +1,16 @@
 import models
 from models import get_db
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from p_model_type import Registration_login
-from sqlalchemy import and_
+from sqlalchemy import and_, select
 from utils.token_generation import hash_passwords
 from fastapi import HTTPException, status
 
 class UserCreationError(Exception):
     pass
 
-async def create_user(user_data:dict,provider:str, db:Session):
+async def create_user(user_data:dict,provider:str, db:AsyncSession):
     # {'id': '106124317363210854486', 'email': '@gmail.com', 'verified_email': True, 'name': 'full name', 'given_name': 'first name', 'family_name': 'last name', 'picture': 'https://lh3.googleusercontent.com/a/ACg8ocKaB3SgzhN1nS059s7D1re6z0eTnG6wtUDl5A695G-8Akhvq5GD'}
     # {'email': '123@123.com', 'given_name': '123', 'family_name': '456', 'name': '123 456', 'password': 'string', 'id': None, 'verified_email': False, 'picture': None, 'provider': 'Local'}
     if not user_data:
@@ -18,14 +18,16 @@ async def create_user(user_data:dict,provider:str, db:Session):
     if user_data["access_type"].lower() == "user":
         print(f"user creation inside access_type: user")
         try:
-            query = db.query(models.User).filter(and_(models.User.email_address == user_data["email"], models.User.provider == provider))
-            user_details = query.first()
+            query = select(models.User).filter(and_(models.User.email_address == user_data["email"], models.User.provider == provider))
+            user_details = (await db.execute(query)).scalars().first()
             if user_details and user_details.provider == "Local":
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Record already Exists, try logging into the account")
         except SQLAlchemyError as e:
             raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"unable to connect to DB {e}")
         
         if not user_details:
+            # hashed before anything is written so a busy password pool cannot leave an account without login details
+            h_pass = await hash_passwords(password=user_data["password"]) if provider == "Local" else None
             user_details = models.User(
                 oauth_id = user_data["id"],
                 email_address = user_data["email"],
@@ -39,24 +41,23 @@ async def create_user(user_data:dict,provider:str, db:Session):
             )
             try: 
                 db.add(user_details)
-                db.commit()
-                db.refresh(user_details)
+                await db.commit()
+                await db.refresh(user_details)
                 
             except SQLAlchemyError as e:
-                db.rollback() 
+                await db.rollback() 
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=f"unable to create details: {str(e.args), str(e.code)}")
 
             if user_details.provider == "Local":
-                h_pass = hash_passwords(password=user_data["password"]) 
                 password_details = models.LoginDetails(
                     user_id = user_details.user_id,
                     hashed_password = h_pass
                 )
                 try:
                     db.add(password_details)
-                    db.commit()
+                    await db.commit()
                 except SQLAlchemyError as e:
-                    db.rollback() 
+                    await db.rollback() 
                     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to create details: {str(e)}")
             return user_details
         return user_details
@@ -64,14 +65,16 @@ async def create_user(user_data:dict,provider:str, db:Session):
     elif user_data["access_type"].lower() == "provider":
         print(f"user creation inside access_type: provider")
         try:
-            query = db.query(models.ProviderUser).filter(and_(models.ProviderUser.email_address == user_data["email"]), provider == models.ProviderUser.provider)
-            user_details = query.first()
+            query = select(models.ProviderUser).filter(and_(models.ProviderUser.email_address == user_data["email"]), provider == models.ProviderUser.provider)
+            user_details = (await db.execute(query)).scalars().first()
             if user_details and user_details.provider == "Local":
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Record already Exists, try logging into the account")
         except SQLAlchemyError as e:
             raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"unable to connect to DB {e}")
         
         if not user_details:
+            # hashed before anything is written so a busy password pool cannot leave an account without login details
+            h_pass = await hash_passwords(password=user_data["password"]) if provider == "Local" else None
             user_details = models.ProviderUser(
                 oauth_id = user_data["id"],
                 email_address = user_data["email"],
@@ -85,46 +88,46 @@ async def create_user(user_data:dict,provider:str, db:Session):
             )
             try: 
                 db.add(user_details)
-                db.commit()
-                db.refresh(user_details)
+                await db.commit()
+                await db.refresh(user_details)
                 
             except SQLAlchemyError as e:
-                db.rollback() 
+                await db.rollback() 
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=f"unable to create details: {str(e.args), str(e.code)}")
 
             if user_details.provider == "Local":
-                h_pass = hash_passwords(password=user_data["password"]) 
                 password_details = models.ProviderLoginDetails(
                     user_id = user_details.user_id,
                     hashed_password = h_pass
                 )
                 try:
                     db.add(password_details)
-                    db.commit()
+                    await db.commit()
                 except SQLAlchemyError as e:
-                    db.rollback() 
+                    await db.rollback() 
                     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to create details: {str(e)}")
             return user_details
         return user_details
 
-def get_user_details(email_address:str, access_type:str, db:Session):
+async def get_user_details(email_address:str, access_type:str, db:AsyncSession):
     """Get user details by email address"""
     if access_type.lower() == "user":
         try:
-            query = db.query(models.User.email_address,
+            query = select(models.User.email_address,
                             models.User.user_id,
                             models.User.first_name,
                             models.User.last_name,
                             models.User.verified_email,
                             models.User.access_type,
                             models.User.provider,
-                            models.LoginDetails.hashed_password
+                            models.LoginDetails.hashed_password,
+                            models.User.tier
                             ).join(
                                 models.LoginDetails,
                                 models.User.user_id == models.LoginDetails.user_id) 
-            record = query.filter(and_(
+            record = (await db.execute(query.filter(and_(
                 models.User.provider=="Local", models.User.verified_email == "False", models.User.email_address == email_address
-            )).first()
+            )))).first()
             print(f"record: {record}")
         except SQLAlchemyError as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something wrong with our service, please try again later")
@@ -138,24 +141,26 @@ def get_user_details(email_address:str, access_type:str, db:Session):
             "verified_email":record[4],
             "access_type":record[5],
             "provider":record[6],
-            "hashed_password":record[7]
+            "hashed_password":record[7],
+            "tier":record[8]
         }
     elif access_type.lower()== "provider":
         try:
-            query = db.query(models.ProviderUser.email_address,
+            query = select(models.ProviderUser.email_address,
                             models.ProviderUser.user_id,
                             models.ProviderUser.first_name,
                             models.ProviderUser.last_name,
                             models.ProviderUser.verified_email,
                             models.ProviderUser.access_type,
                             models.ProviderUser.provider,
-                            models.ProviderLoginDetails.hashed_password
+                            models.ProviderLoginDetails.hashed_password,
+                            models.ProviderUser.tier
                             ).join(
                                 models.ProviderLoginDetails,
                                 models.ProviderUser.user_id == models.ProviderLoginDetails.user_id) 
-            record = query.filter(and_(
+            record = (await db.execute(query.filter(and_(
                 models.ProviderUser.provider=="Local", models.ProviderUser.verified_email == "False", models.ProviderUser.email_address == email_address
-            )).first()
+            )))).first()
             print(f"record: {record}")
         except SQLAlchemyError as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something wrong with our service, please try again later")
@@ -169,12 +174,13 @@ def get_user_details(email_address:str, access_type:str, db:Session):
             "verified_email":record[4],
             "access_type":record[5],
             "provider":record[6],
-            "hashed_password":record[7]
+            "hashed_password":record[7],
+            "tier":record[8]
         }
 
 
 
-async def user_documents(doc_data:dict, db:Session) -> dict:
+async def user_documents(doc_data:dict, db:AsyncSession) -> dict:
     if not doc_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No document data found with valid user_id found")
     document_details = models.UserDocuments(
@@ -183,8 +189,8 @@ async def user_documents(doc_data:dict, db:Session) -> dict:
     )
     try:
         db.add(document_details)
-        db.commit()
-        db.refresh(document_details)
+        await db.commit()
+        await db.refresh(document_details)
         return {"document_id":document_details.document_id,"document_path":document_details.document_path,"user_id":document_details.user_id}
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to create document data {str(e)}")
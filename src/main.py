@@ -1,13 +1,22 @@
+import time
+# taken before the app modules are imported, the startup report counts the imports as well
+STARTED_AT = time.perf_counter()
 from fastapi import FastAPI
 import uvicorn
 from dotenv import load_dotenv
 import models
-from models import engine
 from fastapi.middleware.cors import CORSMiddleware
 from routers import project_services, authentication, provider_services
-from utils.logger import setup_logger
+from utils.logger import setup_logger, logging_stats
 from utils.rate_limit import lifespan
 from utils.middleware import CSRFMiddleware, RateLimitMiddleware
+from utils.metrics import MetricsMiddleware, registry
+from fastapi.responses import PlainTextResponse
+from utils.token_generation import password_pool
+from utils.response_cache import catalog_cache
+from utils.tiers import tier_store
+from utils.cache_invalidation import cache_invalidator
+from config import settings
 from sqlalchemy import text
 from contextlib import asynccontextmanager
 
@@ -19,6 +28,7 @@ load_dotenv()
 
 
 app = FastAPI(lifespan=lifespan)
+app.state.started_at = STARTED_AT
 
 origins = [
     "http://localhost",
@@ -34,11 +44,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"], 
     allow_headers=["*"],
+    # pagination cursors and ETags are response headers, cross origin clients can only read exposed ones
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 #order matters since there will be taken in sequence.
-# app.add_middleware(RateLimitMiddleware)
-# app.add_middleware(CSRFMiddleware)   
+if settings.RATE_LIMIT_MIDDLEWARE_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+if settings.CSRF_MIDDLEWARE_ENABLED:
+    app.add_middleware(CSRFMiddleware)
+# added last so it is the outermost and also times requests the other middlewares reject
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(authentication.router, prefix="/api/v1", tags=["authentication"])
 app.include_router(project_services.router, prefix="/api/v1", tags=["Project Services"])
@@ -48,6 +64,32 @@ app.include_router(provider_services.router, prefix="/api/v1", tags=["Provider S
 def read_root():
     return {"Welcome to fastapi"}
 
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "password_pool": password_pool.stats(),
+        "api_key_cache": project_services.api_key_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "tiers": tier_store.stats(),
+        "cache_invalidation": cache_invalidator.stats(),
+        "db_pool": models.engine.pool.stats(),
+        "rate_limiter": {
+            "strategy": app.state.rate_limiter.name,
+            "fallback_hits": app.state.rate_limiter.fallback_hits,
+            "redis_breaker": app.state.redis_breaker.stats()
+        },
+        "logging": logging_stats(),
+        "startup": app.state.startup
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        registry.render(settings.METRICS_MULTIPROCESS_DIR, stale_after=settings.METRICS_FLUSH_SECONDS * 3),
+        media_type="text/plain; version=0.0.4"
+    )
+
 if __name__ =="__main__":
     uvicorn.run('main:app', port=8082, reload=True)
          
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""Applies pending schema migrations, run once per deploy before the new version of the app starts.
+
+Usage (from src/): python migrate.py [--status]
+"""
+import argparse
+import asyncio
+import models
+from migrations import migrate, pending_versions
+from utils.logger import setup_logger, logger
+
+
+async def main(status:bool):
+    engine = models.get_engine()
+    try:
+        if status:
+            pending = await pending_versions(engine)
+            for version, name in pending:
+                print(f"pending {version} {name}")
+            print(f"{len(pending)} pending migrations")
+        else:
+            applied = await migrate(engine)
+            logger.info(f"{len(applied)} migrations applied, schema is up to date")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--status", action="store_true", help="list pending migrations without applying them")
+    args = parser.parse_args()
+    setup_logger()
+    asyncio.run(main(args.status))
@@ -0,0 +1,121 @@
+import time
+from sqlalchemy import text
+from models import SCHEMA_NAME, SERVER_SEARCH_VECTOR_SQL, Base
+from utils.logger import logger
+
+# any constant works as long as nothing else in the database takes the same advisory lock
+MIGRATION_LOCK_KEY = 727110401
+
+# Schema changes for tables that already exist, Base.metadata.create_all only creates missing tables.
+# Each version runs once and is recorded in schema_migrations, new steps get the next version number.
+# The steps stay idempotent since databases set up before versioning run them once more.
+MIGRATIONS = [
+    (1, "project_details_key_id", [
+        f"ALTER TABLE {SCHEMA_NAME}.project_details ADD COLUMN IF NOT EXISTS key_id VARCHAR",
+        f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{SCHEMA_NAME}_project_details_key_id ON {SCHEMA_NAME}.project_details (key_id)",
+        # Backfill from the stored mask where its 20 leading characters still hold the full key id.
+        # Rows that cannot be recovered this way are filled in the first time their key is validated.
+        f"""
+        UPDATE {SCHEMA_NAME}.project_details pd SET key_id = c.kid
+        FROM (
+            SELECT project_details_id, kid, count(*) OVER (PARTITION BY kid) AS n
+            FROM (
+                SELECT project_details_id,
+                       substring(left(msecret_key, 20) from '^ak-(?:dev|prod)-.{{0,4}}-([0-9a-f]{{8}})') AS kid
+                FROM {SCHEMA_NAME}.project_details
+                WHERE key_id IS NULL
+            ) candidates
+            WHERE kid IS NOT NULL
+        ) c
+        WHERE pd.project_details_id = c.project_details_id
+          AND c.n = 1
+          AND NOT EXISTS (SELECT 1 FROM {SCHEMA_NAME}.project_details taken WHERE taken.key_id = c.kid)
+        """,
+    ]),
+    (2, "project_details_salt_version_id", [
+        f"ALTER TABLE {SCHEMA_NAME}.project_details ADD COLUMN IF NOT EXISTS salt_version_id VARCHAR REFERENCES {SCHEMA_NAME}.versioning (version_id)",
+        f"CREATE INDEX IF NOT EXISTS ix_{SCHEMA_NAME}_project_details_salt_version_id ON {SCHEMA_NAME}.project_details (salt_version_id)",
+        f"CREATE INDEX IF NOT EXISTS ix_{SCHEMA_NAME}_hmac_keys_project_id ON {SCHEMA_NAME}.hmac_keys (project_id)",
+        f"""
+        UPDATE {SCHEMA_NAME}.project_details pd SET salt_version_id = sv.version_id
+        FROM {SCHEMA_NAME}.hmac_keys hk
+        JOIN {SCHEMA_NAME}.versioning sv ON sv.version_name = hk.hmac_version
+        WHERE hk.project_id = pd.project_id
+          AND pd.salt_version_id IS NULL
+        """,
+    ]),
+    (3, "users_tier", [
+        f"ALTER TABLE {SCHEMA_NAME}.users ADD COLUMN IF NOT EXISTS tier VARCHAR NOT NULL DEFAULT 'free'",
+        f"ALTER TABLE {SCHEMA_NAME}.provider_users ADD COLUMN IF NOT EXISTS tier VARCHAR NOT NULL DEFAULT 'free'",
+    ]),
+    (4, "keyset_pagination_indexes", [
+        f"CREATE INDEX IF NOT EXISTS ix_project_user_id_created_at_project_id ON {SCHEMA_NAME}.project (user_id, created_at, project_id)",
+        f"CREATE INDEX IF NOT EXISTS ix_add_servers_owned_by_created_at_server_id ON {SCHEMA_NAME}.add_servers (owned_by, created_at, server_id)",
+    ]),
+    # project names are unique per user, create_project relies on it instead of checking first
+    (5, "project_user_id_project_name_unique", [
+        f"CREATE UNIQUE INDEX IF NOT EXISTS uq_project_user_id_project_name ON {SCHEMA_NAME}.project (user_id, project_name)",
+    ]),
+    (6, "add_servers_search_vector", [
+        f"ALTER TABLE {SCHEMA_NAME}.add_servers ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({SERVER_SEARCH_VECTOR_SQL}) STORED",
+        f"CREATE INDEX IF NOT EXISTS ix_add_servers_search_vector ON {SCHEMA_NAME}.add_servers USING gin (search_vector)",
+    ]),
+    # separate step, creating the extension needs privileges the full text search does not
+    (7, "add_servers_trigram", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX IF NOT EXISTS ix_add_servers_server_name_trgm ON {SCHEMA_NAME}.add_servers USING gin (server_name gin_trgm_ops)",
+        f"CREATE INDEX IF NOT EXISTS ix_add_servers_author_trgm ON {SCHEMA_NAME}.add_servers USING gin (author gin_trgm_ops)",
+    ]),
+    # the mask lookup of keys issued before key_id existed, the index shrinks as those rows get backfilled
+    (8, "project_details_legacy_mask_index", [
+        f"CREATE INDEX IF NOT EXISTS ix_project_details_legacy_msecret_key ON {SCHEMA_NAME}.project_details (msecret_key) WHERE key_id IS NULL",
+    ]),
+]
+
+async def applied_versions(conn) -> set:
+    rows = await conn.execute(text(f"SELECT version FROM {SCHEMA_NAME}.schema_migrations"))
+    return set(rows.scalars())
+
+async def migrate(engine) -> list:
+    """Creates the schema and missing tables and applies every pending version, returns the versions applied.
+    The advisory lock makes replicas started together wait for the first one instead of racing it."""
+    applied = []
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.commit()
+        try:
+            await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_NAME}"))
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {SCHEMA_NAME}.schema_migrations "
+                "(version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ))
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.commit()
+            done = await applied_versions(conn)
+            await conn.commit()
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                start = time.perf_counter()
+                # one transaction per version, a failing step leaves the versions before it applied
+                for statement in statements:
+                    await conn.execute(text(statement))
+                await conn.execute(
+                    text(f"INSERT INTO {SCHEMA_NAME}.schema_migrations (version, name) VALUES (:version, :name)"),
+                    {"version": version, "name": name}
+                )
+                await conn.commit()
+                applied.append(version)
+                logger.info(f"migration {version} {name} applied in {(time.perf_counter() - start) * 1000:.1f}ms")
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            await conn.commit()
+    return applied
+
+async def pending_versions(engine) -> list:
+    """Versions not applied yet, without taking the lock or changing anything"""
+    async with engine.connect() as conn:
+        exists = (await conn.execute(text("SELECT to_regclass(:table)"), {"table": f"{SCHEMA_NAME}.schema_migrations"})).scalar()
+        done = await applied_versions(conn) if exists else set()
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
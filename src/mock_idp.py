@@ -0,0 +1,70 @@
+"""Local stand-in for Google's OAuth endpoints, for tests and benchmarks of the login flow.
+
+Run: uvicorn mock_idp:app --port 8090 and point the app at it with
+OAUTH_AUTH_URI=http://localhost:8090/authorize OAUTH_TOKEN_URI=http://localhost:8090/token
+OAUTH_USERINFO_URI=http://localhost:8090/userinfo
+/authorize approves every login straight away, MOCK_IDP_DELAY_SECONDS adds latency to /token and /userinfo.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import secrets
+from urllib.parse import urlencode
+from fastapi import FastAPI, Form, Header, HTTPException, status
+from fastapi.responses import RedirectResponse
+from typing import Optional
+
+DELAY_SECONDS = float(os.getenv("MOCK_IDP_DELAY_SECONDS", "0"))
+
+app = FastAPI(title="mock identity provider")
+# code -> (code_challenge, email), access token -> email; both only live in this process
+codes = {}
+tokens = {}
+
+def mock_user(email:str) -> dict:
+    name = email.split("@")[0]
+    return {
+        "id": hashlib.sha256(email.encode()).hexdigest()[:21],
+        "email": email,
+        "verified_email": True,
+        "name": f"{name} mock",
+        "given_name": name,
+        "family_name": "mock",
+        "picture": None
+    }
+
+@app.get("/authorize")
+async def authorize(redirect_uri:str, state:str, code_challenge:Optional[str] = None, login_hint:Optional[str] = None):
+    code = secrets.token_urlsafe(16)
+    codes[code] = (code_challenge, login_hint or f"user-{code[:8].lower()}@example.com")
+    return RedirectResponse(f"{redirect_uri}?{urlencode({'code': code, 'state': state})}")
+
+@app.post("/token")
+async def token(code:str = Form(...), code_verifier:Optional[str] = Form(None)):
+    await asyncio.sleep(DELAY_SECONDS)
+    if code not in codes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid_grant")
+    code_challenge, email = codes.pop(code)
+    if code_challenge:
+        digest = hashlib.sha256((code_verifier or "").encode()).digest()
+        if base64.urlsafe_b64encode(digest).decode().rstrip("=") != code_challenge:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid_grant")
+    access_token = secrets.token_urlsafe(32)
+    tokens[access_token] = email
+    return {"access_token": access_token, "token_type": "Bearer", "expires_in": 3599}
+
+@app.get("/userinfo")
+async def userinfo(authorization:str = Header(...)):
+    await asyncio.sleep(DELAY_SECONDS)
+    email = tokens.get(authorization.removeprefix("Bearer "))
+    if not email:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid_token")
+    return mock_user(email)
+
+@app.post("/mint")
+async def mint(email:str = Form(...)):
+    """A code without PKCE for benchmarks that skip /authorize"""
+    code = secrets.token_urlsafe(16)
+    codes[code] = (None, email)
+    return {"code": code}
@@ -1,25 +1,56 @@
-from sqlalchemy import Column, String, Integer, create_engine, ForeignKey, Boolean, MetaData, UniqueConstraint, CheckConstraint
+from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, MetaData, UniqueConstraint, CheckConstraint, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import ProgrammingError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import deferred
 from config import settings
+from utils.db_pool import TimedQueuePool
+from utils.metrics import instrument_engine
 import uuid
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
 
 SCHEMA_NAME = "auth"
 metadata_obj = MetaData(schema=SCHEMA_NAME)
-print(f"metadata: {metadata_obj.schema}")
 Base = declarative_base(metadata=metadata_obj)
-engine = create_engine(settings.DATABASE_URL)
-sessionlocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    db = sessionlocal()
-    try:
+_engine = None
+_sessionlocal = None
+
+def get_engine():
+    """The engine is built on first use, importing models (scripts, migrations, tooling) doesn't load the driver"""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            settings.ASYNC_DATABASE_URL,
+            poolclass=TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING
+        )
+        instrument_engine(_engine.sync_engine)
+    return _engine
+
+def get_sessionmaker():
+    global _sessionlocal
+    if _sessionlocal is None:
+        # expire_on_commit is off since attributes cannot be lazy loaded again on an AsyncSession
+        _sessionlocal = async_sessionmaker(bind=get_engine(), autoflush=False, expire_on_commit=False)
+    return _sessionlocal
+
+def __getattr__(name):
+    # models.engine and models.sessionlocal keep working, both are created the first time they are read
+    if name == "engine":
+        return get_engine()
+    if name == "sessionlocal":
+        return get_sessionmaker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def get_db():
+    async with get_sessionmaker()() as db:
         yield db
-    finally:
-        db.close()
 
 class User(Base):
     __tablename__= "users"
@@ -34,6 +65,7 @@ class User(Base):
     verified_email = Column(Boolean, nullable=False)
     picture = Column(String)
     provider = Column(String, nullable=False) 
+    tier = Column(String, nullable=False, server_default=text("'free'"))
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default= text('now()'))
 
 class ProviderUser(Base):
@@ -49,6 +81,7 @@ class ProviderUser(Base):
     verified_email = Column(Boolean, nullable=False)
     picture = Column(String)
     provider = Column(String, nullable=False) 
+    tier = Column(String, nullable=False, server_default=text("'free'"))
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default= text('now()'))
 
 class LoginDetails(Base):
@@ -69,7 +102,12 @@ class ProviderLoginDetails(Base):
 
 class Project(Base):
     __tablename__="project"
-    __table_args__={'schema': SCHEMA_NAME}
+    __table_args__=(
+        UniqueConstraint('user_id', 'project_name', name='uq_project_user_id_project_name'),
+        # keyset pagination of a user's projects by (created_at, project_id)
+        Index('ix_project_user_id_created_at_project_id', 'user_id', 'created_at', 'project_id'),
+        {'schema': SCHEMA_NAME}
+        )
     project_id = Column(String, primary_key=True, nullable=False, index=True, default= lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.users.user_id"), nullable=False, index=True)
     project_name = Column(String, nullable=False, index=True)
@@ -79,19 +117,25 @@ class Project(Base):
 
 class ProjectDetails(Base):
     __tablename__="project_details"
-    __table_args__={'schema': SCHEMA_NAME}
+    __table_args__=(
+        # legacy keys without a stored key_id are looked up by their mask, only those rows are indexed
+        Index('ix_project_details_legacy_msecret_key', 'msecret_key', postgresql_where=text('key_id IS NULL')),
+        {'schema': SCHEMA_NAME}
+        )
     project_details_id =Column(String, primary_key=True, nullable=False, index=True, default= lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.users.user_id"), nullable=False, index=True)
     project_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.project.project_id"), nullable=False, index=True, unique=True)
     secret_key_hash = Column(String, nullable=False, index=True, unique=True)
     msecret_key=Column(String, nullable=False)
+    key_id = Column(String, nullable=True, index=True, unique=True)
+    salt_version_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.versioning.version_id"), nullable=True, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
 
 class HmacKeys(Base):
     __tablename__="hmac_keys"
     __table_args__={'schema': SCHEMA_NAME}
     hmac_id = Column(String, primary_key=True, nullable=False, index=True, default=lambda: str(uuid.uuid4()))
-    project_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.project_details.project_id"), nullable=False)
+    project_id = Column(String, ForeignKey(f"{SCHEMA_NAME}.project_details.project_id"), nullable=False, index=True)
     hmac_version=Column(String, nullable=False, index=True)
 
 class SaltVersion(Base):
@@ -113,11 +157,21 @@ class SaltVersion(Base):
 #     created_by = Column(String, nullable=False)
 #     modified_by = Column(String, nullable=False)
 
+# 'simple' config keeps words unstemmed so prefix queries match what is typed, weights rank name > description > author
+SERVER_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(server_name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'C')"
+)
+
 class AddServers(Base):
     __tablename__ = 'add_servers'
     __table_args__ = (
         UniqueConstraint('server_url', 'server_name', 'version', 'author', name='add_servers_url_version_uc'),
         CheckConstraint("position(' ' in server_name) = 0", name='no_spaces_in_server_name'),
+        # keyset pagination of a provider's servers by (created_at, server_id)
+        Index('ix_add_servers_owned_by_created_at_server_id', 'owned_by', 'created_at', 'server_id'),
+        Index('ix_add_servers_search_vector', 'search_vector', postgresql_using='gin'),
         {'schema': SCHEMA_NAME}
         )
     server_id = Column(String, primary_key=True, nullable=False, index=True, default=lambda: str(uuid.uuid4()))
@@ -132,6 +186,10 @@ class AddServers(Base):
     modified_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), onupdate=text('now()'))
     modified_by = Column(String, nullable=False)
     owned_by = Column(String, ForeignKey(f"{SCHEMA_NAME}.provider_users.user_id"), nullable=False, index=True)
+    # trigram indexes on server_name and author need pg_trgm and are created by migrations.py
+    # only used inside search queries, deferred so loading servers doesn't fetch it. raiseload turns an
+    # accidental attribute access into an error instead of a lazy load an AsyncSession can't do
+    search_vector = deferred(Column(TSVECTOR, Computed(SERVER_SEARCH_VECTOR_SQL, persisted=True)), raiseload=True)
 
 
 
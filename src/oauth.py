@@ -1,37 +1,98 @@
-from google_auth_oauthlib.flow import Flow
 from config import settings
-import requests
+from urllib.parse import urlencode, urlsplit, parse_qs
+import base64
+import functools
+import hashlib
+import json
+import os
+import secrets
 import logging
 
 logger = logging.getLogger(__name__)
-#remove this once you get HTTPS working 11 and 12 lines are testing only
-import os
-os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
-flow = Flow.from_client_secrets_file(
-    client_secrets_file="../client_secret_g.json",
-    redirect_uri=settings.REDIRECT_URL,
-    scopes=["https://www.googleapis.com/auth/userinfo.email",
-            "https://www.googleapis.com/auth/userinfo.profile",
-            "openid"]
-)
+SCOPES = ["https://www.googleapis.com/auth/userinfo.email",
+          "https://www.googleapis.com/auth/userinfo.profile",
+          "openid"]
+
+def load_client_config(path:str) -> dict:
+    """client_id, client_secret and endpoints from the Google client secrets file, or from the environment
+    when there is no file (e.g. against the mock identity provider)"""
+    if os.path.exists(path):
+        with open(path) as f:
+            secrets_file = json.load(f)
+        config = secrets_file.get("web") or secrets_file.get("installed")
+    else:
+        config = {"client_id": settings.GOOGLE_CLIENT_ID, "client_secret": settings.OAUTH_CLIENT_SECRET}
+    return {
+        "client_id": config["client_id"],
+        "client_secret": config["client_secret"],
+        # configured URIs win so logins can be pointed at the mock identity provider
+        "auth_uri": settings.OAUTH_AUTH_URI or config.get("auth_uri"),
+        "token_uri": settings.OAUTH_TOKEN_URI or config.get("token_uri"),
+        "userinfo_uri": settings.OAUTH_USERINFO_URI
+    }
+
+@functools.lru_cache(maxsize=None)
+def get_client_config() -> dict:
+    """Read on the first login instead of at import"""
+    return load_client_config(settings.OAUTH_CLIENT_SECRETS_FILE)
+
+def pkce_pair() -> tuple:
+    """(code_verifier, S256 code_challenge), a fresh pair for every login"""
+    code_verifier = secrets.token_urlsafe(64)
+    digest = hashlib.sha256(code_verifier.encode()).digest()
+    return code_verifier, base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+def authorization_url() -> tuple:
+    """(url, state, code_verifier) of a new login, state and verifier belong to this login only"""
+    client_config = get_client_config()
+    state = secrets.token_urlsafe(32)
+    code_verifier, code_challenge = pkce_pair()
+    params = {
+        "response_type": "code",
+        "client_id": client_config["client_id"],
+        "redirect_uri": settings.REDIRECT_URL,
+        "scope": " ".join(SCOPES),
+        "state": state,
+        "code_challenge": code_challenge,
+        "code_challenge_method": "S256",
+        "access_type": "offline",
+        "prompt": "consent"
+    }
+    return f"{client_config['auth_uri']}?{urlencode(params)}", state, code_verifier
 
-def auth_callback(url:str=None):
+async def auth_callback(http_client, url:str=None, code_verifier:str=None):
+    """Exchanges the code of the callback url for a token and fetches the user info, both on the shared client"""
     if not url:
         return "callback failed no link provided"
     try:
         authorization_response = str(url)
         logger.info(f"Authorization response: {authorization_response}")
-        flow.fetch_token(authorization_response=authorization_response) 
-        credentials = flow.credentials
-        logger.info(f"Credentials: {credentials}")
-        user_info_response = requests.get(
-            "https://www.googleapis.com/oauth2/v2/userinfo",
-            headers={"Authorization": f"Bearer {credentials.token}"}
+        query = parse_qs(urlsplit(authorization_response).query)
+        client_config = get_client_config()
+        if "error" in query or "code" not in query:
+            raise ValueError(f"authorization failed: {query.get('error', ['no code'])[0]}")
+        token_data = {
+            "grant_type": "authorization_code",
+            "code": query["code"][0],
+            "client_id": client_config["client_id"],
+            "client_secret": client_config["client_secret"],
+            "redirect_uri": settings.REDIRECT_URL
+        }
+        # the verifier comes from the state store since the login may have started on another worker
+        if code_verifier:
+            token_data["code_verifier"] = code_verifier
+        token_response = await http_client.post(client_config["token_uri"], data=token_data)
+        token_response.raise_for_status()
+        access_token = token_response.json()["access_token"]
+        user_info_response = await http_client.get(
+            client_config["userinfo_uri"],
+            headers={"Authorization": f"Bearer {access_token}"}
         )
+        user_info_response.raise_for_status()
         user_info = user_info_response.json()
         logger.info(f"User info: {user_info}")
         # Process and store user information in PostgreSQL
         return {"message": "Authentication successful", "user": user_info, "provider":"Google"}
     except Exception as e:
-        return {"message": "bad request", "error": e}
\ No newline at end of file
+        return {"message": "bad request", "error": e}
@@ -33,6 +33,12 @@ class Project(BaseModel):
     server_environment:str='prod'
     permissions:Optional[List[str]]=None
 
+class ApiKeyBatch(BaseModel):
+    api_keys:List[str]
+
+class ProjectBulk(BaseModel):
+    projects:List[Project]
+
 class AddServer(BaseModel):
     server_name: str #cant have spaces in name
     
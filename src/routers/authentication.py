@@ -1,10 +1,12 @@
-from oauth import flow, auth_callback
+from oauth import authorization_url, auth_callback
 from fastapi import Depends, HTTPException, Request, APIRouter, status
 from models import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from database_scripts import create_user,UserCreationError, get_user_details
 from utils.token_generation import create_token, verify_password, TokenDecoder, validate_app_user
 from p_model_type import Registration_login_password, login_details
+from utils.oauth_state import save_oauth_state, consume_oauth_state
+from utils.tiers import tier_store
 import logging
 from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -16,30 +18,36 @@ router = APIRouter()
 
 security = HTTPBearer()
 
-auth_states = {}
 @router.get("/auth/login")
-async def login():
-    result= flow.authorization_url(prompt="consent")
-
-    auth_url = result[0] if isinstance(result, tuple) else result
-    state = result[1] if isinstance(result, tuple) else None
-
-    if state:
-        auth_states[state] = True
+async def login(request: Request):
+    # state and PKCE verifier are generated per login, nothing is shared between concurrent logins
+    auth_url, state, code_verifier = authorization_url()
+    try:
+        await save_oauth_state(request.app.state.redis, state, code_verifier)
+    except Exception as e:
+        logger.error(f"unable to store oauth state: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Something went wrong, it is not you, Please try after sometime")
     print(auth_url)
     return RedirectResponse(url=auth_url)
 
 @router.get("/auth/callback", status_code=status.HTTP_200_OK)
-async def callback(request: Request, db:Session=Depends(get_db)):
+async def callback(request: Request, db:AsyncSession=Depends(get_db)):
     # Extract the state from query parameters
     state = request.query_params.get("state")
     logger.info(f"State: {state}")
-    if not state or state not in auth_states:
+    if not state:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Link already expired, Try to login in again")
+    try:
+        code_verifier = await consume_oauth_state(request.app.state.redis, state)
+    except Exception as e:
+        logger.error(f"unable to read oauth state: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Something went wrong, it is not you, Please try after sometime")
+    if code_verifier is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Link already expired, Try to login in again")
     try: 
         #Uses Google authentication to login
         logger.info(f"Request URL: {request.url}")
-        response =auth_callback(url=request.url)
+        response = await auth_callback(request.app.state.http_client, url=request.url, code_verifier=code_verifier)
         logger.info(f"Response: {response}")
         if response.get("message") == "bad request":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Issue with your login, Please try again")
@@ -50,7 +58,6 @@ async def callback(request: Request, db:Session=Depends(get_db)):
     try:
         #create a record in DB if its the first time or get the details for jwt payload
         user = await create_user(user_data=user_data,provider=response['provider'], db=db)
-        auth_states.pop(state,None)
         #add logging here to save it
     except UserCreationError as e:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Something went wrong, it is not you, Please try after sometime") 
@@ -61,11 +68,12 @@ async def callback(request: Request, db:Session=Depends(get_db)):
         "verified_email":user.verified_email,
         "picture": user.picture,
         "provider": user.provider,
-        "email":user.email_address
+        "email":user.email_address,
+        "tier": user.tier
     }
+    await tier_store.remember_user(user.user_id, user.tier)
      # creates JWT token
     token = create_token(user_data=payload)
-    print(token)
     
     # Return HTML instead of JSON
     html_content = f"""
@@ -97,7 +105,7 @@ async def callback(request: Request, db:Session=Depends(get_db)):
     return HTMLResponse(content=html_content)
 
 @router.post("/registration", status_code=status.HTTP_201_CREATED)
-async def create_account(user_details:Registration_login_password, db:Session=Depends(get_db)):
+async def create_account(user_details:Registration_login_password, db:AsyncSession=Depends(get_db)):
     if not user_details:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Required details are not provided")
     if user_details.access_type.lower() == "user": 
@@ -138,35 +146,36 @@ async def create_account(user_details:Registration_login_password, db:Session=De
         "access_type":user.access_type,
         "picture": user.picture,
         "provider": user.provider,
-        "email":user.email_address
+        "email":user.email_address,
+        "tier": user.tier
     }
+    await tier_store.remember_user(user.user_id, user.tier)
     try:
         token = create_token(user_data=payload)
-        print(token)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail = f" error creating token: {str(e)}")
     return {"access_token": token, "token_type": "bearer"} 
 
 @router.post("/login", status_code=status.HTTP_200_OK)
-def log_into_account(login_details:login_details, db:Session=Depends(get_db)):
+async def log_into_account(login_details:login_details, db:AsyncSession=Depends(get_db)):
     if not login_details:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Please provide the details to login")
     try:
-        user_details = get_user_details(email_address=login_details.email_address, access_type=login_details.access_type, db=db)
-        print(f"user_details: {user_details}")
+        user_details = await get_user_details(email_address=login_details.email_address, access_type=login_details.access_type, db=db)
     except UserCreationError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Record doesn't exists, please register to Login")
-    checked_password = verify_password(password=login_details.password,hashed_password=user_details["hashed_password"])
+    checked_password = await verify_password(password=login_details.password,hashed_password=user_details["hashed_password"])
     if checked_password:
         payload= {
             "id": user_details["user_id"],
             "verified_email":user_details["verified_email"],
             "provider": user_details["provider"],
             "email":user_details["email_address"],
-            "access_type": user_details['access_type']
+            "access_type": user_details['access_type'],
+            "tier": user_details["tier"]
         }
+        await tier_store.remember_user(user_details["user_id"], user_details["tier"])
         token = create_token(user_data=payload)
-        print(token)
         return {"access_token": token, "token_type": "bearer"}
     else:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
@@ -186,6 +195,6 @@ async def validate_token(credentials: Request):
         token = credentials.headers.get("Authorization").split(" ")[1]
     else:
         token = credentials.headers.get("Authorization")
-    return await validate_app_user(token)
+    return await validate_app_user(token, request=credentials)
 
 
@@ -1,152 +1,450 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Response, Request
 from utils.logger import logger
 from utils.token_generation import token_validator
 from models import get_db
 import models
-from sqlalchemy.orm import Session
-from p_model_type import Project
-from sqlalchemy import and_
-from utils.keygeneration import generate_api_key, mask_key, hash_with_hmac
-import random
+from sqlalchemy.ext.asyncio import AsyncSession
+from p_model_type import Project, ApiKeyBatch, ProjectBulk
+from sqlalchemy import and_, select, delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import uuid
+import json
+from utils.keygeneration import generate_api_key, mask_key, parse_key_id, api_key_digest
+from utils.cache import TTLCache
+from utils.cache_invalidation import cache_invalidator
+from utils.salt_keyring import salt_keyring
+from utils.tiers import tier_store
+from config import settings
+from typing import Optional
+from utils.pagination import paginate, split_page, cursor_headers
+from utils.response_cache import project_cache
+from utils.etag import owner_etag, matches, not_modified
+from utils.rate_limit import charge_request
 
 router = APIRouter()
 
+PROJECT_NAME_CONSTRAINT = "uq_project_user_id_project_name"
+# unique indexes a freshly generated key can collide with, only these are worth retrying with a new key
+API_KEY_CONSTRAINTS = frozenset({
+    f"ix_{models.SCHEMA_NAME}_project_details_key_id",
+    f"ix_{models.SCHEMA_NAME}_project_details_secret_key_hash",
+})
+SERVER_ENVIRONMENTS = ("dev", "prod")
+# key ids are 32 random bits, a second collision in a row is practically impossible
+PROJECT_KEY_ATTEMPTS = 3
+
+# Resolved /project_key_validation results keyed by a digest of the presented key. The cache is per process,
+# deleting a project drops its entries on every worker through cache_invalidator. A worker that is cut off from
+# Redis can keep serving them for at most API_KEY_CACHE_TTL_SECONDS.
+api_key_cache = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL_SECONDS)
+cache_invalidator.register("api_keys", api_key_cache)
+
+# key rows come back with the owner's tier so the limiter can pick the project's quota without a DB query
+api_key_lookup = select(models.ProjectDetails, models.User.tier).join(models.User, models.User.user_id == models.ProjectDetails.user_id)
+
+async def backfill_key_ids(backfills:list, db:AsyncSession):
+    """Stores the key ids of legacy keys once the keys have been verified, later lookups use the index"""
+    try:
+        for api_details, key_id in backfills:
+            api_details.key_id = key_id
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"unable to backfill key_id for projects {[api_details.project_id for api_details, _ in backfills]}: {str(e)}")
+
+async def load_candidates(condition, db:AsyncSession) -> tuple:
+    """Key rows matching condition with their owner's tier, plus the hmac version names of the rows whose salt
+    version isn't denormalized onto the row yet, keyed by project id"""
+    try:
+        rows = (await db.execute(api_key_lookup.filter(condition))).all()
+        salt_version_names = {}
+        legacy_project_ids = {api_details.project_id for api_details, _ in rows if not api_details.salt_version_id}
+        if legacy_project_ids:
+            salt_version_names = dict((await db.execute(select(models.HmacKeys.project_id, models.HmacKeys.hmac_version).filter(models.HmacKeys.project_id.in_(legacy_project_ids)))).all())
+    except Exception as e:
+        logger.error(f"Error while fetching API details: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail= "Unable to connect to the database")
+    return rows, salt_version_names
+
+async def verify_candidates(api_key:str, candidates:list, salt_version_names:dict) -> tuple:
+    """Checks the key against (row, owner tier) candidates until one matches. Returns the result and the candidate
+    it was checked against, the candidate is None when none of them had a known salt version"""
+    result, match = {"status": "not_found"}, None
+    for api_details, owner_tier in candidates:
+        # the salt comes from the in-memory keyring, the salt table is not queried here
+        salt_version = await salt_keyring.resolve(version_id=api_details.salt_version_id, version_name=salt_version_names.get(api_details.project_id))
+        if not salt_version:
+            logger.error(f"Salt version not found for project {api_details.project_id}")
+            continue
+        result, match = check_api_key(api_key, api_details, salt_version), (api_details, owner_tier)
+        if result["status"] == "valid":
+            break
+    return result, match
+
+def legacy_key_condition(masks:set):
+    # keys issued before key_id existed are found by their mask until they get backfilled, the partial index
+    # on rows without a key_id keeps this an index lookup
+    return and_(models.ProjectDetails.msecret_key.in_(masks), models.ProjectDetails.key_id.is_(None))
+
+def check_api_key(api_key:str, api_details:models.ProjectDetails, salt_version) -> dict:
+    if salt_keyring.hash(salt_version, api_key) == api_details.secret_key_hash:
+        return {
+            "status": "valid",
+            "user_id": api_details.user_id,
+            "project_id": api_details.project_id
+        }
+    return {
+        "status": "invalid"
+    }
+
+def cache_api_key_result(cache_key:str, result:dict, project_id:str = None):
+    # anything but a valid key is cached for a short time so repeated bad keys do not reach the DB
+    ttl = None if result["status"] == "valid" else settings.API_KEY_CACHE_NEGATIVE_TTL_SECONDS
+    api_key_cache.set(cache_key, result, ttl=ttl, tag=project_id)
+
+def new_api_key(project_name:str, server_environment:str, salt_version) -> dict:
+    """Plain key plus everything stored about it, the plain key is only ever returned to the caller once"""
+    api_key = generate_api_key(project_name, server_details=server_environment)
+    return {
+        "api_key": api_key,
+        "key_id": parse_key_id(api_key),
+        "secret_key_hash": salt_keyring.hash(salt_version, api_key),
+        "msecret_key": mask_key(api_key)
+    }
+
+def violated_constraint(error:IntegrityError) -> Optional[str]:
+    # asyncpg's UniqueViolationError carries the constraint name, sqlalchemy wraps it twice
+    cause = getattr(error.orig, "__cause__", None)
+    return getattr(cause, "constraint_name", None) or getattr(error.orig, "constraint_name", None)
+
+def serialize_permissions(permissions) -> Optional[str]:
+    # Project.permissions is a String column, the list is stored as JSON text so names with commas round-trip
+    return json.dumps(permissions) if permissions is not None else None
+
+def create_project_statement(project_id:str, user_id:str, project_name:str, permissions, key:dict, salt_version):
+    """Project, ProjectDetails and HmacKeys rows in one INSERT ... RETURNING statement, the three inserts are
+    data modifying CTEs so they succeed or fail together and the FKs are checked at the end of the statement"""
+    new_project = insert(models.Project).values(
+        project_id=project_id,
+        user_id=user_id,
+        project_name=project_name,
+        permissions=serialize_permissions(permissions)
+        ).returning(models.Project.created_at).cte("new_project")
+    new_details = insert(models.ProjectDetails).values(
+        project_details_id=str(uuid.uuid4()),
+        project_id=project_id,
+        user_id=user_id,
+        secret_key_hash=key["secret_key_hash"],
+        msecret_key=key["msecret_key"],
+        key_id=key["key_id"],
+        salt_version_id=salt_version.version_id
+        ).returning(models.ProjectDetails.project_id).cte("new_details")
+    # saves the version of the salt used to hash the user api key
+    new_hmac = insert(models.HmacKeys).values(
+        hmac_id=str(uuid.uuid4()),
+        project_id=project_id,
+        hmac_version=salt_version.version_name
+        ).returning(models.HmacKeys.project_id).cte("new_hmac")
+    return select(new_project.c.created_at).add_cte(new_details, new_hmac)
+
 @router.post("/project")
-async def create_project(request:Project, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def create_project(request:Project, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     #If request is empty throws the error
     if not request or request.name == '':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="provide details for all the mandatatory fields")
     
-    # Checks if the project name already exists for the user
     if current_user["regular_login_token"]["access_type"] != "user":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to create a project")
-    try:
-        query = db.query(models.Project).filter(and_(models.Project.project_name == request.name), (models.Project.user_id == current_user["regular_login_token"]["id"]))
-        result = query.first()
-    except Exception as e:
-        logger.error(f"Error while checking project name: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to connect to the database")
-    if result:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"project name already exist, project name should be unique")
+    if request.server_environment not in SERVER_ENVIRONMENTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid server environment it can only be prod or dev")
+    user_id = current_user["regular_login_token"]["id"]
     
-    # Fetch a non deprecated salt version and selects a random version for salting the api key generated
-    secret_query = db.query(models.SaltVersion).filter_by(is_deprecated=False).all()
-    secret_version = random.choice(secret_query)
+    # Selects a random non deprecated salt version from the keyring for salting the api key generated
+    secret_version = salt_keyring.choose_active()
+    if not secret_version:
+        logger.error("No active salt version available in the keyring")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Service is currently facing an issue Please try again after sometime")
 
-    #Generate API Key and hash it and create a masked api key
-    while True:
-        api_key=generate_api_key(request.name, server_details=request.server_environment)
-        hash_api_key = await hash_with_hmac(api_key=api_key,salt=secret_version.key_value)
-
-        existing_key = db.query(models.ProjectDetails).filter_by(secret_key_hash=hash_api_key).first()
-        if not existing_key:
+    # Duplicate project names and key id collisions are caught by the unique constraints instead of queries
+    # up front, a colliding key is generated again and the project inserted once more.
+    project_id = str(uuid.uuid4())
+    for attempt in range(PROJECT_KEY_ATTEMPTS):
+        key = new_api_key(request.name, request.server_environment, secret_version)
+        try:
+            created_at = (await db.execute(create_project_statement(project_id, user_id, request.name, request.permissions, key, secret_version))).scalar_one()
+            await db.commit()
             break
-    mask_api_key =mask_key(api_key)
+        except IntegrityError as e:
+            await db.rollback()
+            constraint = violated_constraint(e)
+            if constraint == PROJECT_NAME_CONSTRAINT:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"project name already exist, project name should be unique")
+            if constraint not in API_KEY_CONSTRAINTS:
+                logger.warning(f"project {project_id} rejected by constraint {constraint}: {str(e)}")
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="project details violate a database constraint")
+            logger.warning(f"api key collision while creating project {project_id}, attempt {attempt + 1}: {str(e)}")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error occur when creating the new project. user_id {user_id}, project_name:{request.name}, error: {str(e)} ")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Service is currently facing an issue Please try again after sometime")
+    else:
+        logger.error(f"unable to generate a unique api key for project {project_id} after {PROJECT_KEY_ATTEMPTS} attempts")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Service is currently facing an issue Please try again after sometime")
+    logger.info("Project successfully created")
+
+    await project_cache.bump(user_id)
+    return {'message': "data successfully added and project and apikeys are created",
+            'content': {'user_id': user_id,
+                        'project_id': project_id,
+                        'api_key':key["api_key"],
+                        'masked_api_key': key["msecret_key"],
+                        'created_at': created_at,
+                        'permissions': request.permissions}}
+    
+@router.post("/project/bulk")
+async def create_projects_bulk(request:ProjectBulk, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
+    """Creates many projects in one transaction with three multi-row inserts.
+    Every item gets its own result in request order, a name that already exists is reported as a conflict
+    instead of failing the batch. The plain api keys are only returned in this response."""
+    if current_user["regular_login_token"]["access_type"] != "user":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to create a project")
+    if not request.projects:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Projects are missing")
+    if len(request.projects) > settings.PROJECT_BULK_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"at most {settings.PROJECT_BULK_MAX_SIZE} projects can be created per request")
+    user_id = current_user["regular_login_token"]["id"]
+    secret_version = salt_keyring.choose_active()
+    if not secret_version:
+        logger.error("No active salt version available in the keyring")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Service is currently facing an issue Please try again after sometime")
 
-    logger.info(f"All required keys and versions generated")
-    user_project_data = models.Project(
-        user_id=current_user["regular_login_token"]["id"],
-        project_name=request.name,
-        permissions= request.permissions
-    )
+    results = [None] * len(request.projects)
+    specs = {}  # project_id -> (index, spec)
+    seen_names = set()
+    for index, spec in enumerate(request.projects):
+        if not spec.name:
+            results[index] = {"name": spec.name, "status": "invalid", "detail": "provide details for all the mandatatory fields"}
+        elif spec.server_environment not in SERVER_ENVIRONMENTS:
+            results[index] = {"name": spec.name, "status": "invalid", "detail": "Invalid server environment it can only be prod or dev"}
+        elif spec.name in seen_names:
+            results[index] = {"name": spec.name, "status": "conflict", "detail": "project name appears more than once in the request"}
+        else:
+            seen_names.add(spec.name)
+            specs[str(uuid.uuid4())] = (index, spec)
 
-    try:
-        db.add(user_project_data)
-        db.commit()
-        db.refresh(user_project_data)
-        logger.info("Project successfully created")
-
-    # If project successfully created then proceeds to create project Details
-        if user_project_data:
-            project_details_content = models.ProjectDetails(
-            project_id=user_project_data.project_id,
-            user_id=current_user["regular_login_token"]["id"],
-            secret_key_hash=hash_api_key,
-            msecret_key=mask_api_key
-            )
-            db.add(project_details_content)
-            db.commit()
-            db.refresh(project_details_content)
-    # if project Details are created then proceeds to create Hmacdetails for saving the version of the salt used to hash the user api key
-            if project_details_content:
-                hmac_details = models.HmacKeys(
-                    project_id=user_project_data.project_id,
-                    hmac_version=secret_version.version_name
-                )
-                db.add(hmac_details)
-                db.commit()
-            return {'message': "data successfully added and project and apikeys are created",
-                    'content': {'user_id': current_user["regular_login_token"]["id"],
-                                'project_id': user_project_data.project_id,
-                                'api_key':api_key,
-                                'masked_api_key': mask_api_key,
-                                'created_at': user_project_data.created_at,
-                                'permissions': request.permissions}}
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error occur when creating the new project. user_id {current_user["regular_login_token"]["id"]}, project_name:{request.name}, error: {str(e)} ")
+    for attempt in range(PROJECT_KEY_ATTEMPTS):
+        keys = {}
+        key_ids = set()
+        for project_id, (_, spec) in specs.items():
+            key = new_api_key(spec.name, spec.server_environment, secret_version)
+            # a collision inside the batch would fail the whole insert
+            while key["key_id"] in key_ids:
+                key = new_api_key(spec.name, spec.server_environment, secret_version)
+            key_ids.add(key["key_id"])
+            keys[project_id] = key
+        try:
+            created = {}
+            if specs:
+                # existing names are skipped, RETURNING only has the projects that were inserted
+                created = {row.project_id: row.created_at for row in await db.execute(
+                    pg_insert(models.Project).values([
+                        {"project_id": project_id, "user_id": user_id, "project_name": spec.name, "permissions": serialize_permissions(spec.permissions)}
+                        for project_id, (_, spec) in specs.items()
+                        ]).on_conflict_do_nothing(index_elements=["user_id", "project_name"]).returning(models.Project.project_id, models.Project.created_at)
+                    )}
+            if created:
+                await db.execute(insert(models.ProjectDetails).values([
+                    {"project_details_id": str(uuid.uuid4()), "project_id": project_id, "user_id": user_id,
+                     "secret_key_hash": keys[project_id]["secret_key_hash"], "msecret_key": keys[project_id]["msecret_key"],
+                     "key_id": keys[project_id]["key_id"], "salt_version_id": secret_version.version_id}
+                    for project_id in created
+                    ]))
+                await db.execute(insert(models.HmacKeys).values([
+                    {"hmac_id": str(uuid.uuid4()), "project_id": project_id, "hmac_version": secret_version.version_name}
+                    for project_id in created
+                    ]))
+            await db.commit()
+            break
+        except IntegrityError as e:
+            await db.rollback()
+            constraint = violated_constraint(e)
+            if constraint not in API_KEY_CONSTRAINTS:
+                logger.warning(f"bulk project creation for user {user_id} rejected by constraint {constraint}: {str(e)}")
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="project details violate a database constraint")
+            # a key id taken by an existing project, the whole batch is rolled back and gets new keys
+            logger.warning(f"api key collision while creating projects in bulk, attempt {attempt + 1}: {str(e)}")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error occur when creating projects in bulk. user_id {user_id}, projects: {len(specs)}, error: {str(e)} ")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Service is currently facing an issue Please try again after sometime")
+    else:
+        logger.error(f"unable to generate unique api keys for {len(specs)} projects after {PROJECT_KEY_ATTEMPTS} attempts")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Service is currently facing an issue Please try again after sometime")
-    
+
+    for project_id, (index, spec) in specs.items():
+        if project_id not in created:
+            results[index] = {"name": spec.name, "status": "conflict", "detail": "project name already exist, project name should be unique"}
+            continue
+        results[index] = {
+            "name": spec.name,
+            "status": "created",
+            "project_id": project_id,
+            "api_key": keys[project_id]["api_key"],
+            "masked_api_key": keys[project_id]["msecret_key"],
+            "created_at": created[project_id],
+            "permissions": spec.permissions
+            }
+    logger.info(f"{len(created)} of {len(request.projects)} projects created in bulk for user {user_id}")
+    if created:
+        await project_cache.bump(user_id)
+    return {"created": len(created), "results": results}
+
 @router.get("/project_key_validation/")
-async def get_api_key_details(api_key:str = Header(...),db:Session=Depends(get_db)):
+async def get_api_key_details(api_key:str = Header(...),db:AsyncSession=Depends(get_db)):
     """This endpoint is used to validate the API Key and return the user and project details"""
     if not api_key:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="API key is missing")
-    masked_api_key = mask_key(key=api_key)
-    try:
-        api_details = db.query(models.ProjectDetails).filter_by(msecret_key=masked_api_key).first()
-    except Exception as e:
-        logger.error(f"Error while fetching API details: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail= "Unable to connect to the database")
-    if not api_details:
+    cache_key = api_key_digest(api_key)
+    cached = api_key_cache.get(cache_key)
+    if cached is not None:
+        if cached["status"] == "not_found":
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid API Keys")
+        return cached
+    key_id = parse_key_id(api_key)
+    if not key_id:
+        # every key ever issued embeds a key id, anything else cannot match a row
+        cache_api_key_result(cache_key, {"status": "not_found"})
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid API Keys")
-    try:
-        salt_versioning_data = db.query(models.HmacKeys.hmac_version, models.SaltVersion.version_name, models.SaltVersion.key_value).join(models.SaltVersion, models.HmacKeys.hmac_version == models.SaltVersion.version_name).filter(models.HmacKeys.project_id == api_details.project_id).first()
-    except Exception as e:
-        logger.error(f"Error while fetching API details: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail= "Unable to connect to the database")
-    if salt_versioning_data:
-        hmac_version, version_name, key_value = salt_versioning_data
-    else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Salt version not found")
-    hashed_api_key_details = await hash_with_hmac(api_key=api_key, salt=key_value)
-    if hashed_api_key_details == api_details.secret_key_hash:
-        return {
-            "status": "valid",
-            "user_id": api_details.user_id,
-            "project_id": api_details.project_id
-        }
-    else:
-        return {
-            "status": "invalid"
-        }
+    key_id_rows, salt_version_names = await load_candidates(models.ProjectDetails.key_id == key_id, db)
+    result, match = await verify_candidates(api_key, key_id_rows, salt_version_names)
+    legacy = []
+    if result["status"] != "valid":
+        # a legacy key whose embedded id was later given to a new key fails against that key's row,
+        # so the mask is tried whenever the key_id row doesn't verify
+        legacy, salt_version_names = await load_candidates(legacy_key_condition({mask_key(key=api_key)}), db)
+        legacy_result, legacy_match = await verify_candidates(api_key, legacy, salt_version_names)
+        if legacy_match is not None and (match is None or legacy_result["status"] == "valid"):
+            result, match = legacy_result, legacy_match
+    if match is None:
+        if key_id_rows or legacy:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Salt version not found")
+        cache_api_key_result(cache_key, {"status": "not_found"})
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid API Keys")
+    api_details, owner_tier = match
+    cache_api_key_result(cache_key, result, project_id=api_details.project_id)
+    if result["status"] == "valid":
+        await tier_store.remember_api_key(cache_key, owner_tier)
+    # the key id of a legacy key can only be stored while no other row holds it
+    if result["status"] == "valid" and api_details.key_id is None and not key_id_rows:
+        await backfill_key_ids([(api_details, key_id)], db)
+    return result
+
+@router.post("/project_key_validation/batch")
+async def validate_api_keys_batch(request:ApiKeyBatch, http_request:Request, db:AsyncSession=Depends(get_db)):
+    """Validates many API keys at once, the results come back in the same order as the keys"""
+    if not request.api_keys:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="API keys are missing")
+    if len(request.api_keys) > settings.API_KEY_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"at most {settings.API_KEY_BATCH_MAX_SIZE} API keys can be validated per request")
+    # each key counts as one validation, the middleware already charged the first
+    await charge_request(http_request, len(request.api_keys) - 1)
+    cache_keys = [api_key_digest(api_key) for api_key in request.api_keys]
+    results = {}
+    pending = {}
+    for cache_key, api_key in zip(cache_keys, request.api_keys):
+        if cache_key in results or cache_key in pending:
+            continue
+        cached = api_key_cache.get(cache_key)
+        if cached is not None:
+            results[cache_key] = cached
+        else:
+            pending[cache_key] = api_key
+
+    if pending:
+        key_ids = {cache_key: parse_key_id(api_key) for cache_key, api_key in pending.items()}
+        verified = {}  # cache key -> (result, matching candidate)
+        wanted_key_ids = {key_id for key_id in key_ids.values() if key_id}
+        rows_by_key_id = {}
+        if wanted_key_ids:
+            rows, salt_version_names = await load_candidates(models.ProjectDetails.key_id.in_(wanted_key_ids), db)
+            rows_by_key_id = {api_details.key_id: (api_details, tier) for api_details, tier in rows}
+            for cache_key, api_key in pending.items():
+                if key_ids[cache_key] in rows_by_key_id:
+                    result, match = await verify_candidates(api_key, [rows_by_key_id[key_ids[cache_key]]], salt_version_names)
+                    if match is not None:
+                        verified[cache_key] = (result, match)
+        # keys without a key_id row, or failing against it, are matched by their mask, several legacy rows can share one
+        unverified = {cache_key: api_key for cache_key, api_key in pending.items() if key_ids[cache_key] and (cache_key not in verified or verified[cache_key][0]["status"] != "valid")}
+        if unverified:
+            rows, salt_version_names = await load_candidates(legacy_key_condition({mask_key(api_key) for api_key in unverified.values()}), db)
+            rows_by_mask = {}
+            for api_details, tier in rows:
+                rows_by_mask.setdefault(api_details.msecret_key, []).append((api_details, tier))
+            for cache_key, api_key in unverified.items():
+                legacy_result, legacy_match = await verify_candidates(api_key, rows_by_mask.get(mask_key(api_key), []), salt_version_names)
+                if legacy_match is not None and (cache_key not in verified or legacy_result["status"] == "valid"):
+                    verified[cache_key] = (legacy_result, legacy_match)
+
+        backfills = []
+        for cache_key in pending:
+            result, match = verified.get(cache_key, ({"status": "not_found"}, None))
+            project_id = match[0].project_id if match else None
+            if result["status"] == "valid":
+                api_details, owner_tier = match
+                await tier_store.remember_api_key(cache_key, owner_tier)
+                if api_details.key_id is None and key_ids[cache_key] not in rows_by_key_id:
+                    backfills.append((api_details, key_ids[cache_key]))
+            cache_api_key_result(cache_key, result, project_id=project_id)
+            results[cache_key] = result
+        if backfills:
+            await backfill_key_ids(backfills, db)
+
+    return {"results": [results[cache_key] for cache_key in cache_keys]}
 
 @router.get("/project")
-async def get_all_user_projects(db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
-    """Get all Projects for a user"""
+async def get_all_user_projects(
+    request:Request,
+    response:Response,
+    limit:int = Query(settings.PAGE_SIZE_DEFAULT, ge=1, le=settings.PAGE_SIZE_MAX),
+    cursor:Optional[str] = None,
+    db:AsyncSession=Depends(get_db),
+    current_user:dict = Depends(token_validator)
+    ):
+    """Get one page of Projects for a user, the X-Next-Cursor header holds the cursor of the following page"""
     if current_user['regular_login_token']['access_type']!= 'user':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to view projects")
+    # a poll with the current ETag is answered from the change counter alone, no rows and no body
+    etag = await owner_etag(project_cache, current_user['regular_login_token']['id'], "projects", limit, cursor or "")
+    if matches(request, etag):
+        return not_modified(etag)
     try:
-        user_project_details = db.query(
+        user_project_details = select(
             models.ProjectDetails.user_id,
             models.ProjectDetails.project_id,
             models.ProjectDetails.msecret_key,
             models.Project.project_name,
             models.ProjectDetails.created_at,
-            ).join(
+            models.Project.created_at.label("page_created_at"),
+            ).select_from(models.Project).join(
                 models.ProjectDetails, 
                 models.Project.project_id == models.ProjectDetails.project_id
                 ).filter(and_(
                     models.ProjectDetails.user_id == current_user['regular_login_token']['id']),
                     (models.Project.user_id == current_user['regular_login_token']['id']))
-        project_results = user_project_details.all()
+        user_project_details = paginate(user_project_details, models.Project.created_at, models.Project.project_id, limit, cursor)
+        project_results = (await db.execute(user_project_details)).all()
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error while fetching project details: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong while fetching project details")
-    if not project_results:
+    if not project_results and not cursor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No Projects for the user")
+    project_results, next_cursor = split_page(project_results, limit, lambda row: row.page_created_at, lambda row: row.project_id)
+    response.headers.update(cursor_headers(next_cursor, etag))
     project_data = []
-    for user_id, project_id, msecret_key, project_name, created_at in project_results:
+    for user_id, project_id, msecret_key, project_name, created_at, _ in project_results:
          project_data.append({
             "user_id": user_id,
             "project_id": project_id,
@@ -157,30 +455,35 @@ async def get_all_user_projects(db:Session=Depends(get_db), current_user:dict =
     return project_data
 
 @router.get("/project/{project_id}")
-async def get_project_details(project_id:str, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def get_project_details(project_id:str, request:Request, response:Response, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     """Get One project Details for a user"""
     """Get all Projects for a user"""
     if current_user['regular_login_token']['access_type']!= 'user':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to view projects")
+    etag = await owner_etag(project_cache, current_user['regular_login_token']['id'], "project", project_id)
+    if matches(request, etag):
+        return not_modified(etag)
     try:
-        user_project_details = db.query(
+        user_project_details = select(
             models.ProjectDetails.user_id,
             models.ProjectDetails.project_id,
             models.ProjectDetails.msecret_key,
             models.Project.project_name,
             models.ProjectDetails.created_at,
-            ).join(
+            ).select_from(models.Project).join(
                 models.ProjectDetails, 
                 models.Project.project_id == models.ProjectDetails.project_id
                 ).filter(and_(
                     models.ProjectDetails.user_id == current_user['regular_login_token']['id']),
                     (models.Project.project_id == project_id))
-        project_results = user_project_details.first()
+        project_results = (await db.execute(user_project_details)).first()
     except Exception as e:
         logger.error(f"Error while fetching project details: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong while fetching project details")
     if not project_results:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No Projects for the user")
+    if etag:
+        response.headers["ETag"] = etag
     return ({
             "user_id": project_results.user_id,
             "project_id": project_results.project_id,
@@ -190,22 +493,24 @@ async def get_project_details(project_id:str, db:Session=Depends(get_db), curren
         })
 
 @router.delete("/project/{project_id}")
-async def delete_project(project_id:str, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def delete_project(project_id:str, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     """Delete a project for a user"""
     if current_user["regular_login_token"]["access_type"]!= 'user':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to delete a project")
-    project_details = db.query(models.ProjectDetails).filter(and_(models.ProjectDetails.project_id == project_id),(models.ProjectDetails.user_id == current_user["regular_login_token"]['id'])).first()
+    project_details = (await db.execute(select(models.ProjectDetails.project_id).filter(and_(models.ProjectDetails.project_id == project_id),(models.ProjectDetails.user_id == current_user["regular_login_token"]['id'])))).first()
     if not project_details:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail = "Project not found")
     try:
-        db.query(models.HmacKeys).filter_by(project_id=project_id).delete()
-        db.query(models.ProjectDetails).filter(and_(models.ProjectDetails.project_id == project_id), (models.ProjectDetails.user_id == current_user["regular_login_token"]["id"])).delete()
-        db.query(models.Project).filter(and_(models.Project.project_id == project_id), (models.Project.user_id == current_user["regular_login_token"]["id"])).delete()
-        db.commit()
+        await db.execute(delete(models.HmacKeys).filter_by(project_id=project_id))
+        await db.execute(delete(models.ProjectDetails).filter(and_(models.ProjectDetails.project_id == project_id), (models.ProjectDetails.user_id == current_user["regular_login_token"]["id"])))
+        await db.execute(delete(models.Project).filter(and_(models.Project.project_id == project_id), (models.Project.user_id == current_user["regular_login_token"]["id"])))
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error while deleting project: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to delete project: {str(e)}")
+    await cache_invalidator.invalidate("api_keys", project_id)
+    await project_cache.bump(current_user["regular_login_token"]["id"])
     return {"message": "Project deleted Successfully"}
 
 
@@ -1,17 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, Request
 from utils.logger import logger
 from utils.token_generation import token_validator
 from models import get_db
 import models
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from p_model_type import AddServer
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, select, delete, func
+from typing import Optional
+from utils.pagination import paginate, split_page, cached_next_cursor, cursor_headers
+from utils.search_index import server_search_index, public_server, prefix_tsquery, PUBLIC_SERVER_FIELDS
+from utils.response_cache import catalog_cache
+from utils.etag import version_etag, matches, not_modified
+from config import settings
 
 
 router = APIRouter()
 
 @router.post("/add_server")
-async def add_server(request: AddServer, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def add_server(request: AddServer, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     #if request is empty throws the error)
     print(f"request: {request}")
     if current_user["regular_login_token"]["access_type"]!= "provider":
@@ -19,8 +25,8 @@ async def add_server(request: AddServer, db:Session=Depends(get_db), current_use
     if not request or request.server_name == '':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide details for all the mandatory fields")
     
-    db.query = db.query(models.AddServers).filter_by(server_name = request.server_name).first()
-    if db.query:
+    existing_server = (await db.execute(select(models.AddServers.server_id).filter_by(server_name = request.server_name))).first()
+    if existing_server:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail=f"server name: {request.server_name} already exists")
     try:
         server_data = models.AddServers(
@@ -35,97 +41,176 @@ async def add_server(request: AddServer, db:Session=Depends(get_db), current_use
             owned_by = current_user["regular_login_token"]["id"]
             )
         db.add(server_data)
-        db.commit()
-        db.refresh(server_data)
+        await db.commit()
+        await db.refresh(server_data)
+        await catalog_cache.bump(current_user["regular_login_token"]["id"])
+        if settings.SEARCH_BACKEND == "memory":
+            server_search_index.add(public_server(server_data))
         logger.info(f"server {request.server_name} added successfully")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error while adding server: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to add server: {str(e)}")
     
     return {"status":"Success", "message":f"Server {request.server_name} added successfully"}
     
+def server_details(server:models.AddServers) -> dict:
+    # the bodies are cached in Redis, server_api_key is write only and never part of them
+    return {
+        **public_server(server),
+        "last_modified_by":server.modified_by,
+        "last_modified_at":server.modified_at
+        }
+
 @router.get("/get_all_servers/")
-async def get_all_servers(db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def get_all_servers(
+    http_request:Request,
+    limit:int = Query(settings.PAGE_SIZE_DEFAULT, ge=1, le=settings.PAGE_SIZE_MAX),
+    cursor:Optional[str] = Query(None, max_length=200),
+    current_user:dict = Depends(token_validator)
+    ):
+    """One page of the provider's servers, the X-Next-Cursor header (also next_cursor in the body) holds the cursor of the following page"""
     if current_user['regular_login_token']['access_type']!='provider':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to view the servers")
-    try:
-        servers = db.query(models.AddServers).filter_by(owned_by = current_user['regular_login_token']['id']).all()
-    except Exception as e:
-        logger.error(f"Error while fetching servers: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to fetch servers currently, please try after sometime")
-    if not servers:
-        return {"status":"Success", "message": "No servers found for the user, please add the servers"}
-    servers_list = []
-    for server in servers:
-        server_data = {
-            "server_id": server.server_id,
-            "server_name": server.server_name,
-            "description": server.description,
-            "author": server.author,
-            "version": server.version,
-            "server_url": server.server_url,
-            "server_type": server.server_type,
-            "server_api_key": server.server_api_key,
-            "owned_by":server.owned_by,
-            "last_modified_by":server.modified_by,
-            "last_modified_at":server.modified_at,
-            "created_at":server.created_at
-            }
-        servers_list.append(server_data)
-    return {"status":"Success", "message": "servers fetched successfully", "servers":servers_list}         
+    owner_id = current_user['regular_login_token']['id']
+
+    # concurrent misses share one load, it runs on its own session so no single request's session is shared
+    async def load_servers():
+        query = paginate(
+            select(models.AddServers).filter_by(owned_by = owner_id),
+            models.AddServers.created_at, models.AddServers.server_id, limit, cursor
+            )
+        try:
+            async with models.get_sessionmaker()() as db:
+                servers = (await db.execute(query)).scalars().all()
+        except Exception as e:
+            logger.error(f"Error while fetching servers: {e}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to fetch servers currently, please try after sometime")
+        if not servers and not cursor:
+            return {"status":"Success", "message": "No servers found for the user, please add the servers"}
+        servers, next_cursor = split_page(servers, limit, lambda server: server.created_at, lambda server: server.server_id)
+        servers_list = [server_details(server) for server in servers]
+        # next_cursor goes first, the header is read back from the cached body with cached_next_cursor
+        return {"next_cursor": next_cursor, "status":"Success", "message": "servers fetched successfully", "servers":servers_list}
+
+    # one round trip reads the change counter for the ETag and the cached body, a poll with the current ETag
+    # is answered from the counter alone
+    name = f"servers:{limit}:{cursor or ''}"
+    version, payload = await catalog_cache.read(owner_id, name)
+    etag = version_etag(catalog_cache, owner_id, version, "servers", limit, cursor or "")
+    if matches(http_request, etag):
+        return not_modified(etag)
+    if payload is None:
+        payload = await catalog_cache.load(owner_id, name, version, load_servers)
+    return Response(content=payload, media_type="application/json", headers=cursor_headers(cached_next_cursor(payload), etag))
     
 @router.get("/get_server/{server_id}")
-async def get_server_details_by_id(server_id:str, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def get_server_details_by_id(server_id:str, http_request:Request, current_user:dict = Depends(token_validator)):
     if current_user['regular_login_token']['access_type']!='provider':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to view the servers")
+    owner_id = current_user['regular_login_token']['id']
+
+    async def load_server():
+        try:
+            async with models.get_sessionmaker()() as db:
+                servers_by_server_id = (await db.execute(select(models.AddServers).filter(and_(models.AddServers.owned_by == owner_id), (models.AddServers.server_id == server_id)))).scalars().first()
+        except Exception as e:
+            logger.error(f"Error while fetching servers: {e}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to fetch servers currently, please try after sometime")
+        if not servers_by_server_id:
+            return {"status":"Success", "message": "No servers found for the user, please add the servers"}
+        return {"status":"Success", "message": "servers fetched successfully", "servers":server_details(servers_by_server_id)}
+
+    name = f"server:{server_id}"
+    version, payload = await catalog_cache.read(owner_id, name)
+    etag = version_etag(catalog_cache, owner_id, version, "server", server_id)
+    if matches(http_request, etag):
+        return not_modified(etag)
+    if payload is None:
+        payload = await catalog_cache.load(owner_id, name, version, load_server)
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag} if etag else None)
+
+@router.get("/search_servers")
+async def search_servers(
+    q:str = Query(..., min_length=1, max_length=100),
+    server_type:Optional[str] = None,
+    version:Optional[str] = None,
+    limit:int = Query(20, ge=1, le=settings.PAGE_SIZE_MAX),
+    db:AsyncSession=Depends(get_db),
+    current_user:dict = Depends(token_validator)
+    ):
+    """Ranked search over the catalog by server name, description and author.
+    Every word also matches as a prefix for autocomplete, misspelled names and authors are found by trigram similarity."""
+    if settings.SEARCH_BACKEND == "memory":
+        return {"status":"Success", "message": "servers fetched successfully", "servers": server_search_index.search(q, server_type, version, limit)}
+
+    similarity = func.greatest(func.similarity(models.AddServers.server_name, q), func.similarity(models.AddServers.author, q))
+    # % uses the trigram indexes, @@ the GIN index on search_vector, postgres ORs the two bitmap scans
+    conditions = [models.AddServers.server_name.op("%")(q), models.AddServers.author.op("%")(q)]
+    score = similarity
+    ts_query = prefix_tsquery(q)
+    if ts_query:
+        ts_query = func.to_tsquery("simple", ts_query)
+        conditions.append(models.AddServers.search_vector.op("@@")(ts_query))
+        score = func.greatest(func.ts_rank_cd(models.AddServers.search_vector, ts_query), similarity)
+    query = select(*(getattr(models.AddServers, field) for field in PUBLIC_SERVER_FIELDS), score.label("score")).filter(or_(*conditions))
+    if server_type:
+        query = query.filter(models.AddServers.server_type == server_type)
+    if version:
+        query = query.filter(models.AddServers.version == version)
+    query = query.order_by(score.desc(), models.AddServers.server_name).limit(limit)
     try:
-        servers_by_server_id = db.query(models.AddServers).filter(and_(models.AddServers.owned_by == current_user['regular_login_token']['id']), (models.AddServers.server_id == server_id)).first()
+        servers = [dict(row._mapping) for row in (await db.execute(query)).all()]
     except Exception as e:
-        logger.error(f"Error while fetching servers: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to fetch servers currently, please try after sometime")
-    if not servers_by_server_id:
-        return {"status":"Success", "message": "No servers found for the user, please add the servers"}
-    return {"status":"Success", "message": "servers fetched successfully", "servers":servers_by_server_id}         
+        logger.error(f"Error while searching servers: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to search servers currently, please try after sometime")
+    return {"status":"Success", "message": "servers fetched successfully", "servers": servers}
 
 @router.put("/update_server/{server_id}")
-async def update_server(server_id: str, request: AddServer, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def update_server(server_id: str, request: AddServer, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     #if request is empty throws the error
     if current_user["regular_login_token"]["access_type"]!= "provider":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to update a server")
     if not request or request.server_name == "":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail = "provide details for all the mandatory fields")
-    db.query = db.query(models.AddServers).filter(and_(models.AddServers.server_id == server_id, models.AddServers.owned_by == current_user["regular_login_token"]["id"])).first()
-    if not db.query:
+    server = (await db.execute(select(models.AddServers).filter(and_(models.AddServers.server_id == server_id, models.AddServers.owned_by == current_user["regular_login_token"]["id"])))).scalars().first()
+    if not server:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"server with id: {server_id} not found")
     try:
-        db.query.server_name = request.server_name
-        db.query.description = request.description
-        db.query.author = request.author
-        db.query.version = request.version
-        db.query.server_url = request.server_url
-        db.query.server_type = request.server_type
-        db.query.server_api_key = request.server_api_key
-        db.query.modified_by = current_user["regular_login_token"]["id"]
-        db.commit()
-        db.refresh(db.query)
+        server.server_name = request.server_name
+        server.description = request.description
+        server.author = request.author
+        server.version = request.version
+        server.server_url = request.server_url
+        server.server_type = request.server_type
+        server.server_api_key = request.server_api_key
+        server.modified_by = current_user["regular_login_token"]["id"]
+        await db.commit()
+        await db.refresh(server)
+        await catalog_cache.bump(current_user["regular_login_token"]["id"])
+        if settings.SEARCH_BACKEND == "memory":
+            server_search_index.add(public_server(server))
         logger.info(f"server {request.server_name} updated successfully")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error while updating server: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to update server: {str(e)}")
     return {"status": "Success", "message": f"Server {request.server_name} updated successfully"}
     
 @router.delete("/delete_server/{server_id}")
-async def delete_server(server_id:str, db:Session=Depends(get_db), current_user:dict = Depends(token_validator)):
+async def delete_server(server_id:str, db:AsyncSession=Depends(get_db), current_user:dict = Depends(token_validator)):
     if current_user['regular_login_token']['access_type']!='provider':
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to delete a server")
     try:
-        db.query(models.AddServers).filter(and_(models.AddServers.server_id == server_id),(models.AddServers.owned_by == current_user["regular_login_token"]["id"])).delete()
-        db.commit()
+        deleted = await db.execute(delete(models.AddServers).filter(and_(models.AddServers.server_id == server_id),(models.AddServers.owned_by == current_user["regular_login_token"]["id"])))
+        await db.commit()
+        if deleted.rowcount:
+            await catalog_cache.bump(current_user["regular_login_token"]["id"])
+        if settings.SEARCH_BACKEND == "memory" and deleted.rowcount:
+            server_search_index.remove(server_id)
         logger.info(f"server with id: {server_id} deleted successfully")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error while deletting server: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to delete the server, please try after sometime.")
     return {"status": "Success", "message": f"Server with id: {server_id} deleted successfully"}
@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    """Bounded in-process cache, entries are evicted least recently used first and expire after their ttl.
+    Entries can carry a tag so every entry belonging to e.g. a project can be dropped at once.
+    clock returns the current time in seconds, tests pass their own to move time forward."""
+
+    def __init__(self, maxsize:int, ttl:float, clock = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value, tag)
+        self._tags = {}  # tag -> set of keys
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value, tag = entry
+            if expires_at <= self.clock():
+                self._remove(key, tag)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl:float = None, tag:str = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._untag(key, old[2])
+            self._data[key] = (self.clock() + ttl, value, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                evicted_key, (_, _, evicted_tag) = self._data.popitem(last=False)
+                self._untag(evicted_key, evicted_tag)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._remove(key, entry[2])
+
+    def invalidate_tag(self, tag:str) -> int:
+        """Drops every entry stored with the tag, returns the number of entries removed"""
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._data.pop(key, None)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key, tag):
+        self._data.pop(key, None)
+        self._untag(key, tag)
+
+    def _untag(self, key, tag):
+        if tag is None:
+            return
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._tags.pop(tag, None)
@@ -0,0 +1,104 @@
+import asyncio
+from utils.logger import logger
+
+CHANNEL = "cache-invalidation"
+
+
+class CacheInvalidator:
+    """Drops tagged entries of per-process TTLCaches on every worker.
+
+    invalidate() drops the tag locally and publishes "<cache name>:<tag>" on a Redis channel, every worker
+    listens on it and drops the same tag from its own copy. A worker that lost its subscription, or never got
+    one, may have missed messages, so it clears its registered caches once it is subscribed. Without Redis only the
+    local copy is invalidated and the other workers' entries live until their ttl runs out."""
+
+    def __init__(self, channel:str = CHANNEL, poll_timeout:float = 1.0, retry_interval:float = 1.0):
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.retry_interval = retry_interval
+        self.redis = None
+        self._caches = {}
+        self._listen_task = None
+        self.published = 0
+        self.received = 0
+        self.resubscribes = 0
+        self.errors = 0
+
+    def register(self, name:str, cache):
+        self._caches[name] = cache
+
+    def bind(self, redis):
+        self.redis = redis
+
+    async def invalidate(self, name:str, tag:str):
+        self._caches[name].invalidate_tag(tag)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(self.channel, f"{name}:{tag}")
+            self.published += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"publishing the invalidation of {name}:{tag} failed: {e}")
+
+    def apply(self, message:str):
+        name, _, tag = message.partition(":")
+        cache = self._caches.get(name)
+        if cache is not None:
+            cache.invalidate_tag(tag)
+
+    def start(self):
+        if self._listen_task is None and self.redis is not None:
+            self._listen_task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+
+    async def _listen_loop(self):
+        missed = False
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.channel)
+                if missed:
+                    self.resubscribes += 1
+                    for cache in self._caches.values():
+                        cache.clear()
+                    missed = False
+                while True:
+                    # polled with a timeout, a blocking read would trip the client's short socket timeout
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=self.poll_timeout)
+                    if message is not None and message["type"] == "message":
+                        self.received += 1
+                        self.apply(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                missed = True
+                logger.warning(f"cache invalidation subscription failed: {e}")
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+            await asyncio.sleep(self.retry_interval)
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "received": self.received,
+            "resubscribes": self.resubscribes,
+            "errors": self.errors
+        }
+
+
+cache_invalidator = CacheInvalidator()
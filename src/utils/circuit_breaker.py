@@ -0,0 +1,83 @@
+import asyncio
+import time
+from utils.logger import logger
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails calls fast once a dependency keeps failing.
+
+    closed: calls go through with a timeout, failure_threshold failures in a row open the circuit.
+    open: calls are refused straight away with CircuitOpen until reset_timeout seconds passed.
+    half_open: a single probe call is let through, success closes the circuit and failure opens it again."""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name:str, failure_threshold:int = 5, reset_timeout:float = 5.0, call_timeout:float = 0.1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def _set_state(self, state:str):
+        if state != self.state:
+            logger.warning(f"{self.name} circuit breaker {self.state} -> {state}")
+            self.state = state
+
+    def _record_success(self):
+        self._probing = False
+        self.failures = 0
+        self._set_state(self.CLOSED)
+
+    def _record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._set_state(self.OPEN)
+
+    async def call(self, fn, *args, **kwargs):
+        if not self._allow():
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit is open")
+        try:
+            async with asyncio.timeout(self.call_timeout):
+                result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            # the caller went away, not a verdict on the dependency, but a cancelled probe must not block the next one
+            self._probing = False
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        self._record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from utils.logger import logger
+from utils.metrics import registry, Gauge, Histogram, Counter
+
+DB_POOL_CHECKOUT_WAIT = registry.register(Histogram("db_pool_checkout_wait_seconds", "Time to get a connection from the pool, opening a new one included"))
+DB_POOL_TIMEOUTS = registry.register(Counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout"))
+DB_POOL_CHECKED_OUT = registry.register(Gauge("db_pool_checked_out", "Connections currently in use"))
+DB_POOL_OVERFLOW = registry.register(Gauge("db_pool_overflow", "Connections open beyond pool_size"))
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default async queue pool, plus how long every checkout had to wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            wait_time = time.perf_counter() - started_at
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            DB_POOL_CHECKOUT_WAIT.observe(wait_time)
+            DB_POOL_CHECKED_OUT.set(self.checkedout())
+            DB_POOL_OVERFLOW.set(max(0, self.overflow()))
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        DB_POOL_CHECKED_OUT.set(self.checkedout())
+        DB_POOL_OVERFLOW.set(max(0, self.overflow()))
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "checkout_wait_avg_ms": round(self.wait_time_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "checkout_wait_max_ms": round(self.wait_time_max * 1000, 3)
+        }
+
+
+async def prewarm_pool(engine, connections:int):
+    """Opens the connections up front so the first requests after a deploy do not pay for the connect"""
+    if connections <= 0:
+        return
+    started_at = time.perf_counter()
+    opened = await asyncio.gather(*(engine.connect().start() for _ in range(connections)), return_exceptions=True)
+    failed = [connection for connection in opened if isinstance(connection, Exception)]
+    for connection in opened:
+        if not isinstance(connection, Exception):
+            await connection.close()
+    if failed:
+        logger.error(f"db pool prewarm opened {connections - len(failed)} of {connections} connections: {failed[0]}")
+    else:
+        logger.info(f"db pool prewarmed with {connections} connections in {(time.perf_counter() - started_at) * 1000:.1f}ms")
@@ -0,0 +1,39 @@
+import hashlib
+from fastapi import Request, Response, status
+from utils.logger import logger
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the parts that decide the body, e.g. owner, change counter and page"""
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def version_etag(cache, owner:str, version:str, *parts):
+    """ETag from a change counter already read from the cache, None when there is none"""
+    if version is None:
+        return None
+    return make_etag(cache.namespace, owner, version, *parts)
+
+async def owner_etag(cache, owner:str, *parts):
+    """ETag from the owner's change counter in the cache, None when Redis is not reachable"""
+    if cache.redis is None:
+        return None
+    try:
+        version = await cache.version(owner)
+    except Exception as e:
+        logger.warning(f"etag version lookup failed: {e}")
+        return None
+    return version_etag(cache, owner, version, *parts)
+
+def matches(request:Request, etag:str) -> bool:
+    """If-None-Match check, the header may hold several tags or *"""
+    header = request.headers.get("if-none-match")
+    if not header or etag is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, a W/ prefix does not matter
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+def not_modified(etag:str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
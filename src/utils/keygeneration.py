@@ -2,7 +2,10 @@ import secrets
 import uuid
 import hmac
 import hashlib
-from typing import Literal
+import re
+from typing import Literal, Optional
+
+KEY_ID_PATTERN = re.compile(r"^[0-9a-f]{8}$")
 
 def generate_api_key(project_name:str, server_details:Literal["dev", "prod"] = "dev")->str:
     if server_details == "dev":
@@ -16,9 +19,29 @@ def generate_api_key(project_name:str, server_details:Literal["dev", "prod"] = "
     else:
         raise ValueError("Invalid server details it can only be prod or dev")
     
+def parse_key_id(api_key:str)->Optional[str]:
+    """Extracts the key id embedded in the key prefix: ak-<env>-<name[:4]>-<key_id>.<token>"""
+    prefix, separator, _ = api_key.rpartition(".")
+    if not separator:
+        return None
+    key_id = prefix.rsplit("-", 1)[-1]
+    return key_id if KEY_ID_PATTERN.match(key_id) else None
+
+def api_key_digest(api_key:str)->str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
 def mask_key(key:str)->str:
     return f"{key[:20]}.............{key[-4:]}"
 
 async def hash_with_hmac(api_key:str, salt:str)->str:
     secret = salt
-    return hmac.new(secret.encode(),api_key.encode(),hashlib.sha256).hexdigest()
\ No newline at end of file
+    return hmac.new(secret.encode(),api_key.encode(),hashlib.sha256).hexdigest()
+
+def hmac_template(salt:str):
+    """HMAC already keyed with the salt, copy it per hash instead of re-keying"""
+    return hmac.new(salt.encode(), digestmod=hashlib.sha256)
+
+def hash_with_template(api_key:str, template)->str:
+    h = template.copy()
+    h.update(api_key.encode())
+    return h.hexdigest()
@@ -0,0 +1,311 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from utils.logger import logger
+from utils.circuit_breaker import CircuitOpen
+from utils.metrics import RATE_LIMIT_DECISIONS
+
+
+class RateLimitResult:
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed:bool, limit:int, remaining:int, reset_after:float, retry_after:float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+# GCRA: the key holds the theoretical arrival time (tat) of the next request in ms. Every request moves it
+# forward by cost * period/limit, a request is refused while the tat would end up more than one period ahead of now.
+# Returns {allowed, remaining, reset_after_ms, retry_after_ms} in a single round trip.
+GCRA_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3] or 1)
+local interval = period / limit
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + tonumber(clock[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - period
+if now < allow_at then
+    return {0, 0, math.ceil(tat - now), math.ceil(allow_at - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at) / interval), math.ceil(new_tat - now), 0}
+"""
+
+
+class RedisRateLimiter:
+    """GCRA limiter evaluated server side by one Lua script, shared by every worker"""
+    name = "redis"
+
+    def __init__(self, redis, breaker = None):
+        self._script = redis.register_script(GCRA_SCRIPT)
+        self.breaker = breaker
+
+    async def hit(self, key:str, limit:int, period:float, cost:int = 1) -> RateLimitResult:
+        args = [limit, int(period * 1000), cost]
+        if self.breaker is not None:
+            allowed, remaining, reset_ms, retry_ms = await self.breaker.call(self._script, keys=[key], args=args)
+        else:
+            allowed, remaining, reset_ms, retry_ms = await self._script(keys=[key], args=args)
+        return RateLimitResult(bool(allowed), limit, int(remaining), int(reset_ms) / 1000, int(retry_ms) / 1000)
+
+
+class MemoryRateLimiter:
+    """The same GCRA kept in process memory, a stand-in for Redis in tests and a per process limiter"""
+    name = "memory"
+
+    def __init__(self, max_keys:int = 100000):
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+
+    async def hit(self, key:str, limit:int, period:float, cost:int = 1) -> RateLimitResult:
+        return self.hit_now(key, limit, period, time.monotonic() * 1000, cost)
+
+    def hit_now(self, key:str, limit:int, period:float, now:float, cost:int = 1) -> RateLimitResult:
+        period_ms = period * 1000
+        interval = period_ms / limit
+        tat = max(self._tats.get(key, now), now)
+        new_tat = tat + interval * cost
+        allow_at = new_tat - period_ms
+        if now < allow_at:
+            return RateLimitResult(False, limit, 0, (tat - now) / 1000, (allow_at - now) / 1000)
+        self._tats[key] = new_tat
+        self._tats.move_to_end(key)
+        while len(self._tats) > self.max_keys:
+            self._tats.popitem(last=False)
+        return RateLimitResult(True, limit, math.floor((now - allow_at) / interval), (new_tat - now) / 1000)
+
+
+class _LocalWindow:
+    """What one worker knows about a key: Redis totals from the last sync plus its own unsynced hits"""
+    __slots__ = ("limit", "period", "window", "prev_count", "curr_count", "pending")
+
+    def __init__(self, limit:int, period:float, window:int):
+        self.limit = limit
+        self.period = period
+        self.window = window
+        self.prev_count = 0
+        self.curr_count = 0
+        self.pending = 0
+
+    def roll(self, window:int):
+        if window == self.window + 1:
+            self.prev_count = self.curr_count + self.pending
+        else:
+            self.prev_count = 0
+        self.window = window
+        self.curr_count = 0
+        self.pending = 0
+
+    def estimate(self, now:float) -> float:
+        # sliding window counter: the previous window counts for the part of it still inside the period
+        elapsed = now / self.period - self.window
+        return self.prev_count * (1 - elapsed) + self.curr_count + self.pending
+
+    def retry_after(self, now:float) -> float:
+        elapsed = now / self.period - self.window
+        current = self.curr_count + self.pending
+        if current >= self.limit or not self.prev_count:
+            return (1 - elapsed) * self.period
+        # moment the weighted previous window has decayed enough for one more request
+        free_at = 1 - (self.limit - 1 - current) / self.prev_count
+        return max(0.0, free_at - elapsed) * self.period
+
+
+class HybridRateLimiter:
+    """Sliding window limiter decided in process memory and reconciled with Redis counters in batches.
+
+    Requests below the limit cost no network call, the consumed counts are sent every sync_interval seconds
+    in one pipeline that also reads back the totals of every worker. Each of the workers admits at most
+    limit * overshoot / workers requests per key between syncs, after that it syncs the key before admitting
+    more. All workers together therefore go at most limit * overshoot over the limit, or one request per
+    worker when that share rounds down to zero."""
+    name = "hybrid"
+
+    def __init__(self, redis, sync_interval:float = 0.05, overshoot:float = 0.1, max_keys:int = 100000, breaker = None, workers:int = 1):
+        self.redis = redis
+        self.breaker = breaker
+        self.sync_interval = sync_interval
+        self.overshoot = overshoot
+        self.workers = max(1, workers)
+        self.max_keys = max_keys
+        self._windows = {}
+        self._outbox = {}  # redis window key -> (increment, ttl)
+        self._dirty = set()
+        self._task = None
+        self.redis_round_trips = 0
+        self.redis_commands = 0
+
+    def unsynced_budget(self, limit:int) -> int:
+        """Hits one worker may admit for a key before it has to sync, its share of the allowed overshoot"""
+        return max(1, int(limit * self.overshoot / self.workers))
+
+    async def hit(self, key:str, limit:int, period:float, cost:int = 1) -> RateLimitResult:
+        now = time.time()
+        local = self._local_window(key, limit, period, now)
+        # a loop since other requests may have admitted more while this one waited for the sync
+        while local.pending and local.pending + cost > self.unsynced_budget(limit):
+            await self._sync([key])
+            local = self._local_window(key, limit, period, now)
+        estimate = local.estimate(now)
+        reset_after = (local.window + 1) * period - now
+        if estimate + cost > limit:
+            return RateLimitResult(False, limit, 0, reset_after, local.retry_after(now))
+        local.pending += cost
+        window_key = f"{key}:{local.window}"
+        increment, _ = self._outbox.get(window_key, (0, 0))
+        self._outbox[window_key] = (increment + cost, int(period * 2))
+        self._dirty.add(key)
+        return RateLimitResult(True, limit, max(0, math.floor(limit - estimate - cost)), reset_after)
+
+    def _local_window(self, key:str, limit:int, period:float, now:float) -> _LocalWindow:
+        window = int(now // period)
+        local = self._windows.get(key)
+        if local is None or local.limit != limit or local.period != period:
+            local = self._windows[key] = _LocalWindow(limit, period, window)
+        elif local.window != window:
+            local.roll(window)
+        return local
+
+    async def _sync(self, keys):
+        """Sends every queued increment and refreshes the Redis totals of the given keys in one round trip"""
+        outbox, self._outbox = self._outbox, {}
+        snapshot = []
+        pipe = self.redis.pipeline(transaction=False)
+        for window_key, (increment, ttl) in outbox.items():
+            pipe.incrby(window_key, increment)
+            pipe.expire(window_key, ttl)
+        for key in keys:
+            local = self._windows.get(key)
+            if local is None:
+                continue
+            # only the increments sent by this pipeline are in the totals it reads back, a sync running
+            # concurrently may have taken the rest of the outbox
+            flushed, _ = outbox.get(f"{key}:{local.window}", (0, 0))
+            snapshot.append((key, local, local.window, flushed))
+            pipe.get(f"{key}:{local.window}")
+            pipe.get(f"{key}:{local.window - 1}")
+        self.redis_round_trips += 1
+        self.redis_commands += len(outbox) * 2 + len(snapshot) * 2
+        try:
+            if self.breaker is not None:
+                results = await self.breaker.call(pipe.execute)
+            else:
+                results = await pipe.execute()
+        except Exception:
+            # keep the increments so they are sent with the next sync
+            for window_key, (increment, ttl) in outbox.items():
+                queued, _ = self._outbox.get(window_key, (0, 0))
+                self._outbox[window_key] = (queued + increment, ttl)
+            raise
+        totals = results[len(outbox) * 2:]
+        for index, (key, local, window, flushed) in enumerate(snapshot):
+            if local.window != window:
+                continue
+            current, previous = totals[index * 2], totals[index * 2 + 1]
+            # the flushed hits are part of the Redis total now, anything admitted meanwhile stays pending.
+            # Window counters only grow, a pipeline overtaken by a newer one must not lower them
+            local.curr_count = max(local.curr_count, int(current or 0))
+            local.prev_count = max(local.prev_count, int(previous or 0))
+            local.pending = max(0, local.pending - flushed)
+
+    async def sync(self):
+        keys, self._dirty = self._dirty, set()
+        if keys or self._outbox:
+            try:
+                await self._sync(keys)
+            except Exception:
+                self._dirty |= keys
+                raise
+        self._evict_idle()
+
+    def _evict_idle(self):
+        if len(self._windows) <= self.max_keys:
+            now = time.time()
+            stale = [key for key, local in self._windows.items() if int(now // local.period) > local.window + 1]
+        else:
+            stale = list(self._windows)[:len(self._windows) - self.max_keys]
+        for key in stale:
+            if key not in self._dirty:
+                self._windows.pop(key, None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.error(f"final rate limit sync failed: {e}")
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except CircuitOpen:
+                # the breaker already logged the outage, counts stay queued until Redis is back
+                pass
+            except Exception as e:
+                logger.error(f"rate limit sync failed: {e}")
+
+
+class FallbackRateLimiter:
+    """Checks with the shared limiter and falls back to a per process one whenever that fails,
+    with a circuit breaker on the Redis calls an outage costs no extra latency per request.
+    The fallback counts per worker, so during an outage each worker allows the full limit on its own."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.fallback_hits = 0
+
+    @property
+    def name(self) -> str:
+        return self.primary.name
+
+    async def hit(self, key:str, limit:int, period:float, cost:int = 1) -> RateLimitResult:
+        try:
+            result = await self.primary.hit(key, limit, period, cost)
+            limiter = self.primary.name
+        except Exception:
+            self.fallback_hits += 1
+            result = await self.fallback.hit(key, limit, period, cost)
+            limiter = self.fallback.name
+        RATE_LIMIT_DECISIONS.inc((limiter, "allowed" if result.allowed else "denied"))
+        return result
+
+    def start(self):
+        if hasattr(self.primary, "start"):
+            self.primary.start()
+
+    async def stop(self):
+        if hasattr(self.primary, "stop"):
+            await self.primary.stop()
@@ -1,24 +1,126 @@
+import atexit
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from config import settings
 
 # Create a logger instance
 logger = logging.getLogger(__name__)
 
-def setup_logger():
+TEXT_FORMAT = '%(asctime)s - %(name)s - [%(filename)s:%(lineno)d - %(funcName)s()] - %(levelname)s - %(message)s'
+
+# attributes every LogRecord has, anything else was passed through extra= and goes into the JSON line
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, fields passed with extra= are kept as top level keys"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+            "func": record.funcName,
+            "process": record.process
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets at most rate records per second through for a hot logger, warnings and errors always pass.
+    The first record of a window after drops carries sampled_dropped with the number of records skipped."""
+
+    def __init__(self, rate:int, min_level:int = logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.min_level = min_level
+        self.window = 0
+        self.count = 0
+        self.dropped = 0
+        self.dropped_total = 0
+
+    def filter(self, record):
+        if record.levelno >= self.min_level:
+            return True
+        window = int(record.created)
+        if window != self.window:
+            self.window = window
+            self.count = 0
+        if self.count >= self.rate:
+            self.dropped += 1
+            self.dropped_total += 1
+            return False
+        self.count += 1
+        if self.dropped:
+            record.sampled_dropped = self.dropped
+            self.dropped = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread, formatting and I/O never run on the caller's thread.
+    When the queue is full the record is dropped and counted instead of blocking the event loop."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the default prepare formats the whole record here, only the message is merged so args changed later don't leak in
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def make_formatter(log_format:str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    if log_format != "text":
+        raise ValueError("Invalid log format it can only be text or json")
+    return logging.Formatter(TEXT_FORMAT)
+
+def setup_logger(log_format:str = None, level:str = None):
+    """Routes every record through a queue, a QueueListener thread owns the console and file handlers"""
+    global _listener
+    log_format = log_format or settings.LOG_FORMAT
+    level = level or settings.LOG_LEVEL
+
     # Get the root logger
     logger = logging.getLogger()
-    
+    stop_logging()
+
     # Clear any existing handlers
     logger.handlers = []
-    
+
     # Set the logging level
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level.upper())
 
-    # Create formatter with file name, line number, and function name
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - [%(filename)s:%(lineno)d - %(funcName)s()] - %(levelname)s - %(message)s'
-    )
+    formatter = make_formatter(log_format)
 
     # Create and configure console handler
     console_handler = logging.StreamHandler(sys.stdout)
@@ -33,11 +135,42 @@ def setup_logger():
     )
     file_handler.setFormatter(formatter)
 
-    # Add handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+    # hot path loggers are sampled so a burst of traffic can't flood the queue
+    for name in settings.LOG_SAMPLED_LOGGERS:
+        sampled = logging.getLogger(name)
+        sampled.filters = [f for f in sampled.filters if not isinstance(f, SamplingFilter)]
+        sampled.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE_PER_SECOND))
 
     # Prevent propagation to avoid duplicate logs
     logger.propagate = False
 
-    return logger 
\ No newline at end of file
+    return logger
+
+def stop_logging():
+    """Flushes whatever is still queued and stops the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def logging_stats() -> dict:
+    root = logging.getLogger()
+    queue_handler = next((h for h in root.handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    sampled = {}
+    for name in settings.LOG_SAMPLED_LOGGERS:
+        for f in logging.getLogger(name).filters:
+            if isinstance(f, SamplingFilter):
+                sampled[name] = f.dropped_total
+    return {
+        "queue_depth": queue_handler.queue.qsize() if queue_handler else 0,
+        "queue_dropped": queue_handler.dropped if queue_handler else 0,
+        "sampled_dropped": sampled
+    }
+
+
+atexit.register(stop_logging)
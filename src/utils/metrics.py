@@ -0,0 +1,275 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+from utils.logger import logger
+
+# Metrics are plain dicts updated from the event loop thread, no locks on the request path.
+# With several workers each one writes a snapshot file to METRICS_MULTIPROCESS_DIR every few seconds and
+# /metrics merges the files of all live workers, so any worker can answer the scrape.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name:str, help:str, labels:tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels:tuple = (), amount:float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels:tuple = (), amount:float = 1.0):
+        self.inc(labels, -amount)
+
+    def set(self, value:float, labels:tuple = ()):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name:str, help:str, labels:tuple = (), buckets:tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value:float, labels:tuple = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self) -> list:
+        return [[list(labels), list(series)] for labels, series in self.values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._flush_task = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _snapshot_path(self, directory:str) -> str:
+        return os.path.join(directory, f"metrics-{os.getpid()}.json")
+
+    def write_snapshot(self, directory:str):
+        path = self._snapshot_path(directory)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def merged_snapshot(self, directory:str = None, stale_after:float = 30.0) -> dict:
+        """This worker's live values plus the last snapshot of every other worker still writing one"""
+        snapshots = [self.snapshot()]
+        if directory:
+            own_path = self._snapshot_path(directory)
+            now = time.time()
+            for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+                if path == own_path:
+                    continue
+                try:
+                    if now - os.path.getmtime(path) > stale_after:
+                        continue
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for snapshot in snapshots:
+            for name, series_list in snapshot.items():
+                metric_series = merged.setdefault(name, {})
+                for labels, value in series_list:
+                    key = tuple(labels)
+                    current = metric_series.get(key)
+                    if current is None:
+                        metric_series[key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        metric_series[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        metric_series[key] = current + value
+        return merged
+
+    def render(self, directory:str = None, stale_after:float = 30.0) -> str:
+        """Prometheus text exposition format"""
+        merged = self.merged_snapshot(directory, stale_after)
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(merged.get(name, {}).items()):
+                label_pairs = list(zip(metric.labels, labels))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{format_labels(label_pairs)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(label_pairs + [('le', bound)])} {cumulative}")
+                total = cumulative + value[len(metric.buckets)]
+                lines.append(f"{name}_bucket{format_labels(label_pairs + [('le', '+Inf')])} {total}")
+                lines.append(f"{name}_sum{format_labels(label_pairs)} {value[-1]}")
+                lines.append(f"{name}_count{format_labels(label_pairs)} {total}")
+        return "\n".join(lines) + "\n"
+
+    def start(self, directory:str, interval:float):
+        if self._flush_task is None and directory:
+            os.makedirs(directory, exist_ok=True)
+            self._flush_task = asyncio.create_task(self._flush_loop(directory, interval))
+
+    async def stop(self, directory:str):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+            try:
+                os.remove(self._snapshot_path(directory))
+            except OSError:
+                pass
+
+    async def _flush_loop(self, directory:str, interval:float):
+        while True:
+            try:
+                self.write_snapshot(directory)
+            except Exception as e:
+                logger.error(f"metrics snapshot failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(pairs:list) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+registry = Registry()
+HTTP_REQUEST_DURATION = registry.register(Histogram("http_request_duration_seconds", "Request latency by route template and status", ("method", "route", "status")))
+HTTP_IN_FLIGHT = registry.register(Gauge("http_requests_in_flight", "Requests being served"))
+DB_QUERY_DURATION = registry.register(Histogram("db_query_duration_seconds", "Duration of single SQL statements"))
+DB_QUERIES_PER_REQUEST = registry.register(Histogram("db_queries_per_request", "SQL statements issued per request", ("route",), COUNT_BUCKETS))
+DB_TIME_PER_REQUEST = registry.register(Histogram("db_time_per_request_seconds", "Time spent in SQL statements per request", ("route",)))
+REDIS_COMMAND_DURATION = registry.register(Histogram("redis_command_duration_seconds", "Redis round trip latency by command", ("command",)))
+RATE_LIMIT_DECISIONS = registry.register(Counter("rate_limit_decisions_total", "Rate limit checks by limiter and outcome", ("limiter", "decision")))
+WORKER_POOL_WAIT = registry.register(Histogram("worker_pool_wait_seconds", "Time a call waited for a free pool worker", ("pool",)))
+WORKER_POOL_REJECTED = registry.register(Counter("worker_pool_rejected_total", "Calls rejected because the pool was saturated", ("pool",)))
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+# set per request by MetricsMiddleware, the SQLAlchemy events add to whatever request they run in
+request_stats = ContextVar("request_stats", default=None)
+
+
+def instrument_engine(sync_engine):
+    """Times every statement of the engine and attributes it to the current request"""
+    if getattr(sync_engine, "_metrics_instrumented", False):
+        return
+    sync_engine._metrics_instrumented = True
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started_at = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._metrics_started_at
+        DB_QUERY_DURATION.observe(duration)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_time += duration
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error:bool = True):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_DURATION.observe(time.perf_counter() - started_at, ("PIPELINE",))
+
+
+class InstrumentedRedis(Redis):
+    """Redis client that records the latency of every command and pipeline"""
+
+    async def execute_command(self, *args, **options):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.observe(time.perf_counter() - started_at, (str(args[0]).upper(),))
+
+    def pipeline(self, transaction:bool = True, shard_hint = None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware recording latency per route template, in-flight requests and DB work per request"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        HTTP_IN_FLIGHT.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started_at
+            HTTP_IN_FLIGHT.dec()
+            request_stats.reset(token)
+            # the router stores the matched route in the scope, its template keeps the label set small
+            route = scope.get("route")
+            route = getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(duration, (scope["method"], route, str(status_code)))
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, (route,))
+            DB_TIME_PER_REQUEST.observe(stats.query_time, (route,))
@@ -1,67 +1,75 @@
 from fastapi import Request,HTTPException, Header, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+import logging
 import secrets
-from utils.logger import logger
-from utils.rate_limit import rate_limit_key
+from utils.rate_limit import rate_limit_key, quota_for
 from fastapi_limiter import FastAPILimiter
 from fastapi.responses import JSONResponse
 from typing import Optional
 
-MESSAGE_LIMIT = 30
-TIME_LIMIT = 60 #seconds
+logger = logging.getLogger(__name__)
 
-class CSRFMiddleware(BaseHTTPMiddleware):
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+STATE_CHANGING_METHODS = frozenset({"POST", "PUT", "DELETE", "PATCH"})
+# authentication endpoints (login, registration) are called before the client has a CSRF cookie
+CSRF_EXEMPT_PATHS = frozenset({"/api/v1/login", "/api/v1/registration", "/api/v1/auth/callback", "/api/v1/auth/jira/callback"})
+# preflight requests and health checks are not rate limited
+RATE_LIMIT_EXEMPT_PATHS = frozenset({"/health", "/metrics"})
+
+
+class CSRFMiddleware:
+    """Plain ASGI middleware, the response is streamed through untouched apart from the cookie header"""
     def __init__(
         self,
         app,
         csrf_token_cookie_name: str = "csrf_token",
-        csrf_token_header_name: str = "X-CSRF-Token"
+        csrf_token_header_name: str = "X-CSRF-Token",
+        exempt_paths: frozenset = CSRF_EXEMPT_PATHS
     ):
-        super().__init__(app)
+        self.app = app
         self.csrf_token_cookie_name = csrf_token_cookie_name
         self.csrf_token_header_name = csrf_token_header_name
+        self.exempt_paths = frozenset(exempt_paths)
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+
         # For GET requests and other "safe" methods, ensure a CSRF token exists
-        if request.method.upper() in ["GET", "HEAD", "OPTIONS"]:
-            response = await call_next(request)
-            
-            # Generate and set a CSRF token if not already present
-            if self.csrf_token_cookie_name not in request.cookies:
-                csrf_token = secrets.token_hex(32)
-                response.set_cookie(
-                    key=self.csrf_token_cookie_name,
-                    value=csrf_token,
-                    httponly=False,  # Must be accessible from JavaScript
-                    samesite="lax",
-                    path="/"
-                )
-                logger.info(f"New CSRF token generated for request to {request.url.path}")
-            
-            return response
+        if method in SAFE_METHODS:
+            connection = HTTPConnection(scope)
+            if self.csrf_token_cookie_name in connection.cookies:
+                return await self.app(scope, receive, send)
+
+            # Generate and set a CSRF token, must be accessible from JavaScript so no HttpOnly
+            cookie = f"{self.csrf_token_cookie_name}={secrets.token_hex(32)}; Path=/; SameSite=lax"
+
+            async def send_with_cookie(message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).append("set-cookie", cookie)
+                await send(message)
+
+            logger.info(f"New CSRF token generated for request to {scope['path']}")
+            return await self.app(scope, receive, send_with_cookie)
         
         # For state-changing methods, validate CSRF token
-        elif request.method.upper() in ["POST", "PUT", "DELETE", "PATCH"]:
-            # Get CSRF token from cookie and header
-            csrf_cookie = request.cookies.get(self.csrf_token_cookie_name)
-            csrf_header = request.headers.get(self.csrf_token_header_name)
+        if method in STATE_CHANGING_METHODS and scope["path"] not in self.exempt_paths:
+            connection = HTTPConnection(scope)
+            csrf_cookie = connection.cookies.get(self.csrf_token_cookie_name)
+            csrf_header = connection.headers.get(self.csrf_token_header_name)
             
-            # Skip validation for authentication endpoints (login, registration)
-            if request.url.path in ["/api/v1/login", "/api/v1/registration", "/api/v1/auth/callback", "/api/v1/auth/jira/callback"]:
-                return await call_next(request)
-            
-            # Validate CSRF token
-            if not csrf_cookie or not csrf_header or csrf_cookie != csrf_header:
-                logger.warning(f"CSRF validation failed for {request.url.path} - Cookie: {csrf_cookie}, Header: {csrf_header}")
-                raise HTTPException(
-                    status_code=403, 
-                    detail=f"CSRF token missing or invalid. Cookie: {csrf_cookie and 'present' or 'missing'}, Header: {csrf_header and 'present' or 'missing'}"
+            if not csrf_cookie or not csrf_header or not secrets.compare_digest(csrf_cookie, csrf_header):
+                logger.warning(f"CSRF validation failed for {scope['path']} - Cookie: {csrf_cookie and 'present' or 'missing'}, Header: {csrf_header and 'present' or 'missing'}")
+                response = JSONResponse(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    content={"detail": f"CSRF token missing or invalid. Cookie: {csrf_cookie and 'present' or 'missing'}, Header: {csrf_header and 'present' or 'missing'}"}
                 )
-            
-            return await call_next(request)
+                return await response(scope, receive, send)
         
         # For other methods, just pass through
-        return await call_next(request)
+        await self.app(scope, receive, send)
 
 
 # Helper function to get CSRF token from request (for use in dependencies if needed)
@@ -76,35 +84,49 @@ def get_csrf_token(
     return csrf_token
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Skip rate limiting for preflight requests and health checks
-        if request.method.upper() == "OPTIONS" or request.url.path in ["/health", "/metrics"]:
-            return await call_next(request)
-        logger.info(f"request in ratelimitmiddleware: {request.headers}")
+class RateLimitMiddleware:
+    """Plain ASGI middleware, the rate limit headers are added to the response start message"""
+    def __init__(self, app, exempt_paths: frozenset = RATE_LIMIT_EXEMPT_PATHS):
+        self.app = app
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+        request = Request(scope, receive)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"request in ratelimitmiddleware: {request.headers}")
         
         try:
-            redis = await FastAPILimiter.redis
             key = await rate_limit_key(request)
-            full_key = f"{FastAPILimiter.prefix}{key}"
+            # Quota of the caller's tier for the route group (e.g., 30 requests/minute for free callers on default routes)
+            group, times, seconds = await quota_for(request)
+            full_key = f"{FastAPILimiter.prefix}{group}:{key}"
             
-            # Atomic increment and check
-            current = await redis.incr(full_key)
-            if current == 1:
-                await redis.expire(full_key, TIME_LIMIT)  # Set expiry only once in seconds
-            
-            # Configured rate limit (e.g., 100 requests/minute)
-            limit = MESSAGE_LIMIT
-            if current > limit:
-                logger.warning(f"Rate limit exceeded for {key}")
-                return JSONResponse(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    content={"error": "rate_limit_exceeded", "message": "Too many requests"},
-                    headers={"Retry-After": "60"}
-                )
-            
-            return await call_next(request)
+            # Atomic check and update in one round trip
+            result = await request.app.state.rate_limiter.hit(full_key, times, seconds)
+            # endpoints doing several units of work per request charge the rest to the same bucket
+            request.state.rate_limit_bucket = (full_key, times, seconds)
         except Exception as e:
             logger.error(f"Rate limit error: {e}")
-            return await call_next(request)
+            return await self.app(scope, receive, send)
+
+        if not result.allowed:
+            logger.warning(f"Rate limit exceeded for {key}")
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"error": "rate_limit_exceeded", "message": "Too many requests"},
+                headers=result.headers()
+            )
+            return await response(scope, receive, send)
+
+        rate_limit_headers = result.headers()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in rate_limit_headers.items():
+                    headers[name] = value
+            await send(message)
 
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,11 @@
+from config import settings
+
+OAUTH_STATE_PREFIX = "oauth-state:"
+
+async def save_oauth_state(redis, state:str, code_verifier:str = None):
+    """Keeps the login state in Redis so the callback can land on any worker, abandoned logins expire"""
+    await redis.set(f"{OAUTH_STATE_PREFIX}{state}", code_verifier or "", ex=settings.OAUTH_STATE_TTL_SECONDS)
+
+async def consume_oauth_state(redis, state:str):
+    """Reads and deletes the state in one step so it can only be used once, None when unknown or expired"""
+    return await redis.getdel(f"{OAUTH_STATE_PREFIX}{state}")
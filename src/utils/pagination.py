@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+# Keyset pagination: a page is "the next limit rows after (created_at, id) of the last row seen", served by a
+# composite (owner, created_at, id) index so every page costs the same no matter how deep it is.
+# Listings return the cursor of the following page in the X-Next-Cursor header (exposed through CORS).
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# cached page bodies start with their cursor so it can be read back without decoding the whole page
+CACHED_CURSOR_PREFIX = '{"next_cursor":'
+_decoder = json.JSONDecoder()
+
+def encode_cursor(created_at:datetime, row_id:str) -> str:
+    """Opaque cursor for the last row of a page"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor:str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def paginate(query, created_at_column, id_column, limit:int, cursor:str = None):
+    """Orders the query by (created_at, id) and asks for one row more than the page to know if another page follows"""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_at_column, id_column) > tuple_(created_at, row_id))
+    return query.order_by(created_at_column, id_column).limit(limit + 1)
+
+def cached_next_cursor(payload:str):
+    """next_cursor of a cached page body built with next_cursor as its first key, only that value is decoded"""
+    if not payload.startswith(CACHED_CURSOR_PREFIX):
+        return None
+    return _decoder.raw_decode(payload, len(CACHED_CURSOR_PREFIX))[0]
+
+def cursor_headers(next_cursor:str = None, etag:str = None) -> dict:
+    headers = {}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+def split_page(rows:list, limit:int, created_at_of, id_of) -> tuple:
+    """(page rows, next cursor or None) from the limit + 1 rows returned by paginate"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(created_at_of(last), id_of(last))
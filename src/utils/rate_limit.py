@@ -1,21 +1,81 @@
 from fastapi import Depends,FastAPI, HTTPException, status, Request, Response
-from utils.token_generation import validate_token_incoming_requests
+from utils.token_generation import validate_token_incoming_requests, password_pool
 from fastapi_limiter.depends import RateLimiter
 from fastapi_limiter import FastAPILimiter
-from redis.asyncio import Redis
+import httpx
 from contextlib import asynccontextmanager
 import os
+import logging
 from config import settings
 from ipaddress import ip_address
-from utils.logger import logger
 from fastapi.responses import JSONResponse
 import models
-from sqlalchemy import text
+from migrations import migrate
+from utils.salt_keyring import salt_keyring
+from utils.limiter import RedisRateLimiter, HybridRateLimiter, MemoryRateLimiter, FallbackRateLimiter
+from utils.circuit_breaker import CircuitBreaker
+from utils.keygeneration import api_key_digest
+from utils.tiers import DEFAULT_TIER, tier_store
+from sqlalchemy import select
+from utils.search_index import server_search_index, public_server
+from utils.response_cache import catalog_cache, project_cache
+from utils.cache_invalidation import cache_invalidator
+from utils.metrics import InstrumentedRedis, registry
+from utils.db_pool import prewarm_pool
+from utils.startup import StartupTimer
+
+logger = logging.getLogger(__name__)
 
 
 PREMIUM_LIMIT = "100/minute"
 FREE_LIMIT = "30/minute"
 
+# Quota per route group and tier, paying tenants get their own budget instead of sharing the free one
+ROUTE_GROUP_LIMITS = {
+    "default": {"free": FREE_LIMIT, "premium": PREMIUM_LIMIT},
+    "catalog": {"free": "60/minute", "premium": "300/minute"},
+    "key_validation": {"free": "600/minute", "premium": "6000/minute"},
+}
+# the first matching path prefix decides the group, everything else is "default"
+ROUTE_GROUPS = (
+    ("/api/v1/project_key_validation", "key_validation"),
+    ("/api/v1/get_all_servers", "catalog"),
+    ("/api/v1/get_server", "catalog"),
+    ("/api/v1/search_servers", "catalog"),
+)
+LIMIT_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+def parse_limit(limit:str) -> tuple:
+    """Turns "100/minute" into (100, 60)"""
+    times, period = limit.split("/")
+    return int(times), LIMIT_PERIODS[period.strip()]
+
+PARSED_LIMITS = {group: {tier: parse_limit(limit) for tier, limit in tiers.items()} for group, tiers in ROUTE_GROUP_LIMITS.items()}
+
+def route_group(path:str) -> str:
+    for prefix, group in ROUTE_GROUPS:
+        if path.startswith(prefix):
+            return group
+    return "default"
+
+async def resolve_tier(request:Request) -> str:
+    """Tier of the user behind the verified token or of the presented API key, from the shared tier store"""
+    memo = getattr(request.state, "token_claims", None)
+    if memo is not None:
+        claims = memo[1]
+        return await tier_store.user_tier(claims.get("id"), claims.get("access_type"))
+    api_key = request.headers.get("api-key")
+    if api_key:
+        return await tier_store.api_key_tier(api_key_digest(api_key)) or DEFAULT_TIER
+    return DEFAULT_TIER
+
+async def quota_for(request:Request, group:str = None) -> tuple:
+    """(group, times, seconds) for the request, call after rate_limit_key so the token claims are memoized"""
+    group = group or route_group(request.url.path)
+    limits = PARSED_LIMITS[group]
+    times, seconds = limits.get(await resolve_tier(request), limits[DEFAULT_TIER])
+    return group, times, seconds
+
 #this is for ip check
 async def get_client_ip(request:Request) -> str:
     """Dynamic Rate limiter based on user tier"""
@@ -40,22 +100,28 @@ async def get_client_ip(request:Request) -> str:
     
 async def rate_limit_key(request:Request):
     try:
-        logger.info(f"request received in rate_limit_key: {request.headers}")
-        payload = await validate_token_incoming_requests(request.headers.get('authorization').split(" ")[1])
-        logger.info(f"payload received by request in rate_limit_key: {payload}")
+        logger.debug(f"request received in rate_limit_key: {request.headers}")
+        payload = await validate_token_incoming_requests(request.headers.get('authorization').split(" ")[1], request=request)
         user_id = payload.get('id')
-        logger.info(f"user_id frompayload received by request in rate_limit_key: {user_id}")
         if user_id:
             ip = await get_client_ip(request)
-            logger.info(f"Rate limiting based on user_id: {user_id}")
+            logger.debug(f"Rate limiting based on user_id: {user_id}")
             return f"ip_{ip}_user_{user_id}"
     except Exception as e:
         logger.debug(f"No valid token, falling back to IP: {e}")
 
+    # MCP servers validating keys are limited per key so each project gets its own quota. Only keys that
+    # already passed validation count, a made up key per request would otherwise get a fresh quota every time
+    api_key = request.headers.get("api-key")
+    if api_key:
+        digest = api_key_digest(api_key)
+        if await tier_store.api_key_tier(digest) is not None:
+            return f"apikey_{digest}"
+
     ip = await get_client_ip(request)
     ua_hash = request.headers.get('user-agent', '')[:20]
     key = f"ip_{ip}_ua{ua_hash}"
-    logger.info(f"Rate limiting with key: {key}")
+    logger.debug(f"Rate limiting with key: {key}")
     return key
 
 
@@ -68,48 +134,37 @@ async def rate_limit_exceeded_callback(request: Request, response: Response, pee
         )
 
 
-class CustomRateLimiter:
-    def __init__(self, times: int = 1, seconds: int = 60):
-        self.times = times
-        self.seconds = seconds
-    
-    async def __call__(self, request: Request):
-        redis = await FastAPILimiter.redis
-        key = await rate_limit_key(request)
-        full_key = f"{FastAPILimiter.prefix}{key}"
-        
-        # Get current count
-        pipe = redis.pipeline()
-        pipe.incr(full_key)
-        pipe.expire(full_key, self.seconds)
-        result = await pipe.execute()
-        
-        current_count = result[0]
-        logger.info(f"Custom limiter - Key: {full_key}, Count: {current_count}, Limit: {self.times}")
-        
-        # If count exceeds limit, raise HTTP exception
-        if current_count > self.times:
-            logger.warning(f"Rate limit exceeded for {key}, count: {current_count}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS, 
-                detail={"error": "rate_limit_exceeded", "message": "Too many requests"},
-                headers={"Retry-After": str(self.seconds)}
-            )
-        
-        return None
+async def charge_request(request:Request, cost:int):
+    """Charges cost more tokens to the bucket the middleware already took one from for this request,
+    e.g. one per key of a batch. Does nothing when the request wasn't rate limited."""
+    bucket = getattr(request.state, "rate_limit_bucket", None)
+    if bucket is None or cost <= 0:
+        return
+    full_key, times, seconds = bucket
+    result = await request.app.state.rate_limiter.hit(full_key, times, seconds, cost)
+    if not result.allowed:
+        logger.warning(f"Rate limit exceeded for {full_key} charging {cost} more")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={"error": "rate_limit_exceeded", "message": "Too many requests"},
+            headers=result.headers()
+        )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-
+    timer = StartupTimer(getattr(app.state, "started_at", None))
     logger.info("Loaded with rate limiter")
     # Initialize Redis connection pool
-    redis = Redis(
+    redis = InstrumentedRedis(
         host=settings.REDIS_HOST,
         port=int(settings.REDIS_PORT),
         # password=settings.REDIS_PASSWORD,
         # ssl=False,
-        decode_responses=True
-        # max_connections=1000  # Adjust based on load
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT
     )
 
     # Test Redis connection
@@ -120,21 +175,86 @@ async def lifespan(app: FastAPI):
         logger.error(f"Redis connection failed: {e}")
 
     logger.info("Redis initialized")
+    app.state.redis = redis
+    catalog_cache.bind(redis)
+    timer.mark("redis")
+    # one pooled client for outgoing calls (OAuth token exchange and user info)
+    app.state.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.HTTP_CLIENT_TIMEOUT_SECONDS, connect=settings.HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS, max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE)
+    )
+    project_cache.bind(redis)
+    tier_store.bind(redis)
+    cache_invalidator.bind(redis)
+    cache_invalidator.start()
+    # limiter calls to redis fail fast while it is down and the per process limiter takes over
+    app.state.redis_breaker = CircuitBreaker(
+        "redis rate limiter",
+        failure_threshold=settings.RATE_LIMIT_BREAKER_FAILURES,
+        reset_timeout=settings.RATE_LIMIT_BREAKER_RESET_SECONDS,
+        call_timeout=settings.RATE_LIMIT_BREAKER_CALL_TIMEOUT_MS / 1000
+    )
+    if settings.RATE_LIMIT_STRATEGY == "hybrid":
+        shared_limiter = HybridRateLimiter(
+            redis,
+            sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL_MS / 1000,
+            overshoot=settings.RATE_LIMIT_ALLOWED_OVERSHOOT,
+            breaker=app.state.redis_breaker,
+            workers=settings.RATE_LIMIT_WORKERS
+        )
+    else:
+        shared_limiter = RedisRateLimiter(redis, breaker=app.state.redis_breaker)
+    app.state.rate_limiter = FallbackRateLimiter(shared_limiter, MemoryRateLimiter())
+    app.state.rate_limiter.start()
     await FastAPILimiter.init(
                             redis,identifier=rate_limit_key,
                             http_callback=rate_limit_exceeded_callback, 
                             prefix="fastapi-limiter:"
                             )
-    
+    timer.mark("rate_limiter")
+
+    registry.start(settings.METRICS_MULTIPROCESS_DIR, settings.METRICS_FLUSH_SECONDS)
+
+    # schema changes are applied by migrate.py once per deploy, running them here is meant for local setups
+    if settings.RUN_MIGRATIONS_ON_STARTUP:
+        try:
+            await migrate(models.engine)
+        except Exception as e:
+            logger.error(f"migrations failed: {e}")
+        timer.mark("migrations")
+    if settings.DB_POOL_PREWARM:
+        await prewarm_pool(models.engine, min(settings.DB_POOL_PREWARM, settings.DB_POOL_SIZE))
+        timer.mark("db_pool")
+
+    if settings.SEARCH_BACKEND == "memory":
+        try:
+            async with models.sessionlocal() as db:
+                server_search_index.load(public_server(server) for server in (await db.execute(select(models.AddServers))).scalars())
+            logger.info(f"search index loaded {len(server_search_index)} servers")
+        except Exception as e:
+            logger.error(f"search index load failed: {e}")
+        timer.mark("search_index")
+
     try:
-        with models.engine.begin()as conn:
-            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS {models.SCHEMA_NAME}'))
-        models.Base.metadata.create_all(bind=models.engine)
+        await salt_keyring.refresh()
     except Exception as e:
-        logger.error(f"database connection failed: {e}")
-    
-    
+        logger.error(f"salt keyring load failed: {e}")
+    salt_keyring.start(settings.SALT_KEYRING_REFRESH_SECONDS)
+    timer.mark("salt_keyring")
+    password_pool.start()
+    timer.mark("password_pool")
+    app.state.startup = timer.report()
+    timer.log()
+
     yield
+    # flushes the counts this worker has not reported yet
+    await app.state.rate_limiter.stop()
+    await salt_keyring.stop()
+    await cache_invalidator.stop()
+    password_pool.shutdown()
+    await registry.stop(settings.METRICS_MULTIPROCESS_DIR)
+    await app.state.http_client.aclose()
     await redis.close()
     await FastAPILimiter.close()
+    await models.engine.dispose()
 
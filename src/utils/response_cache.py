@@ -0,0 +1,182 @@
+import asyncio
+import json
+import time
+import uuid
+from fastapi.encoders import jsonable_encoder
+from config import settings
+from utils.logger import logger
+
+# Reads the owner's version counter and the entry stored under it in one round trip. A missing counter is
+# started from the current time in ns so versions never repeat after the counter was evicted.
+# The entry key is built from ARGV, fine on a single Redis, not on a cluster.
+GET_SCRIPT = """
+local version = redis.call('GET', KEYS[1])
+if not version then
+    redis.call('SET', KEYS[1], ARGV[2], 'NX')
+    version = redis.call('GET', KEYS[1])
+end
+return {version, redis.call('GET', ARGV[1] .. version .. ':' .. ARGV[3])}
+"""
+
+BUMP_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return ARGV[1]
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ResponseCache:
+    """JSON response bodies in Redis under per-owner versioned keys.
+
+    Every entry of an owner lives under the owner's current version, so a write only has to bump the version
+    and all older entries stop being read and expire on their own. Concurrent misses for the same entry are
+    loaded once per process (single flight) and once across processes (a short NX lock the others wait on).
+    Without Redis, or when it fails, the loader is called directly."""
+
+    def __init__(self, namespace:str, ttl:int, lock_ttl:float, lock_wait:float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.redis = None
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.lock_waits = 0
+        self.bumps = 0
+        self.errors = 0
+
+    def bind(self, redis):
+        self.redis = redis
+        self._get = redis.register_script(GET_SCRIPT)
+        self._bump = redis.register_script(BUMP_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+
+    def _version_key(self, owner:str) -> str:
+        return f"{self.namespace}:version:{owner}"
+
+    def _entry_prefix(self, owner:str) -> str:
+        return f"{self.namespace}:{owner}:"
+
+    @staticmethod
+    def encode(body) -> str:
+        return json.dumps(jsonable_encoder(body), separators=(",", ":"))
+
+    async def read(self, owner:str, name:str) -> tuple:
+        """(version, serialized body) of the owner's entry in one round trip. The body is None on a miss,
+        both are None without Redis or when it fails."""
+        if self.redis is None:
+            return None, None
+        try:
+            version, payload = await self._get(keys=[self._version_key(owner)], args=[self._entry_prefix(owner), time.time_ns(), name])
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"{self.namespace} cache read failed: {e}")
+            return None, None
+        if payload is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return version, payload
+
+    async def load(self, owner:str, name:str, version:str, loader) -> str:
+        """Serialized body for an entry read() missed, stored under the version read() returned.
+        The loader may serve several requests, it must not use anything scoped to the calling request (like its DB session)."""
+        if version is None:
+            return self.encode(await loader())
+        entry_key = f"{self._entry_prefix(owner)}{version}:{name}"
+        task = self._inflight.get(entry_key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(entry_key, loader))
+            self._inflight[entry_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(entry_key, None))
+        else:
+            self.coalesced += 1
+        # shielded so a caller that goes away does not cancel the load the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _load(self, entry_key:str, loader) -> str:
+        lock_key = f"{entry_key}:lock"
+        token = uuid.uuid4().hex
+        try:
+            locked = await self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception:
+            locked = False
+        if not locked:
+            # another worker is loading the entry, wait a little for it instead of hitting the DB as well
+            self.lock_waits += 1
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+                try:
+                    payload = await self.redis.get(entry_key)
+                except Exception:
+                    break
+                if payload is not None:
+                    return payload
+
+        payload = self.encode(await loader())
+        self.loads += 1
+        try:
+            await self.redis.set(entry_key, payload, ex=self.ttl)
+            if locked:
+                await self._release(keys=[lock_key], args=[token])
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"{self.namespace} cache write failed: {e}")
+        return payload
+
+    async def version(self, owner:str) -> str:
+        """Current version of the owner's entries, started if missing"""
+        version, _ = await self._get(keys=[self._version_key(owner)], args=[self._entry_prefix(owner), time.time_ns(), ""])
+        return version
+
+    async def bump(self, owner:str):
+        """Invalidates every entry of the owner, call after each write"""
+        if self.redis is None:
+            return
+        try:
+            await self._bump(keys=[self._version_key(owner)], args=[time.time_ns()])
+            self.bumps += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"{self.namespace} cache invalidation failed for {owner}, entries may be stale for {self.ttl}s: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "lock_waits": self.lock_waits,
+            "bumps": self.bumps,
+            "errors": self.errors
+        }
+
+
+catalog_cache = ResponseCache(
+    "catalog",
+    ttl=settings.CATALOG_CACHE_TTL_SECONDS,
+    lock_ttl=settings.CATALOG_CACHE_LOCK_TTL_SECONDS,
+    lock_wait=settings.CATALOG_CACHE_LOCK_WAIT_SECONDS
+)
+# project listings are not cached, only the per-owner change counter is used for their ETags
+project_cache = ResponseCache(
+    "projects",
+    ttl=settings.CATALOG_CACHE_TTL_SECONDS,
+    lock_ttl=settings.CATALOG_CACHE_LOCK_TTL_SECONDS,
+    lock_wait=settings.CATALOG_CACHE_LOCK_WAIT_SECONDS
+)
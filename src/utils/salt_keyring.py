@@ -0,0 +1,125 @@
+import asyncio
+import random
+import time
+import models
+from sqlalchemy import select
+from utils.keygeneration import hmac_template, hash_with_template
+from utils.logger import logger
+from config import settings
+
+
+class SaltEntry:
+    __slots__ = ("version_id", "version_name", "is_deprecated", "template")
+
+    def __init__(self, version_id:str, version_name:str, key_value:str, is_deprecated:bool):
+        self.version_id = version_id
+        self.version_name = version_name
+        self.is_deprecated = is_deprecated
+        # keyed once here, every hash works on a copy
+        self.template = hmac_template(key_value)
+
+
+class SaltKeyring:
+    """In-memory registry of every SaltVersion row with a pre-keyed HMAC per version.
+    Loaded at startup and reloaded in the background so the salt table stays off the request path.
+    A lookup for a version the keyring doesn't know reloads it at most once every min_reload_interval seconds,
+    concurrent misses wait for the same reload instead of queueing up their own."""
+
+    def __init__(self, min_reload_interval:float = 0):
+        self.min_reload_interval = min_reload_interval
+        self._by_id = {}
+        self._by_name = {}
+        self._active = []
+        self._refresh_task = None
+        self._refresh_lock = asyncio.Lock()
+        self._miss_reload = None
+        self._last_miss_reload = float("-inf")
+        self.miss_reloads = 0
+
+    def load(self, rows):
+        by_id, by_name, active = {}, {}, []
+        for row in rows:
+            entry = SaltEntry(row.version_id, row.version_name, row.key_value, row.is_deprecated)
+            by_id[entry.version_id] = entry
+            by_name[entry.version_name] = entry
+            if not entry.is_deprecated:
+                active.append(entry)
+        # swap whole maps so readers never see a half built keyring
+        self._by_id, self._by_name, self._active = by_id, by_name, active
+        logger.info(f"salt keyring loaded {len(by_id)} versions, {len(active)} active")
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            async with models.sessionlocal() as db:
+                rows = (await db.execute(select(models.SaltVersion))).scalars().all()
+            self.load(rows)
+
+    def get(self, version_id:str):
+        return self._by_id.get(version_id)
+
+    def get_by_name(self, version_name:str):
+        return self._by_name.get(version_name)
+
+    async def resolve(self, version_id:str = None, version_name:str = None):
+        """Looks a version up and reloads the keyring if it may have been added after the last refresh"""
+        if not version_id and not version_name:
+            return None
+        lookup = (lambda: self.get(version_id)) if version_id else (lambda: self.get_by_name(version_name))
+        entry = lookup()
+        if entry is None and await self._reload_for_miss():
+            entry = lookup()
+        return entry
+
+    async def _reload_for_miss(self) -> bool:
+        """True once a reload finished, False when the last one is too recent for another to find anything new"""
+        if self._miss_reload is None:
+            if time.monotonic() - self._last_miss_reload < self.min_reload_interval:
+                return False
+            self._last_miss_reload = time.monotonic()
+            self.miss_reloads += 1
+            self._miss_reload = asyncio.ensure_future(self._run_miss_reload())
+        try:
+            # shielded so a cancelled request doesn't cancel the reload the other misses are waiting for
+            await asyncio.shield(self._miss_reload)
+        except Exception as e:
+            logger.error(f"salt keyring reload failed: {e}")
+            return False
+        return True
+
+    async def _run_miss_reload(self):
+        try:
+            await self.refresh()
+        finally:
+            self._miss_reload = None
+
+    def choose_active(self):
+        """Random non deprecated version for salting a new api key, None when no version is active"""
+        active = self._active
+        return random.choice(active) if active else None
+
+    def hash(self, entry:SaltEntry, api_key:str) -> str:
+        return hash_with_template(api_key=api_key, template=entry.template)
+
+    def start(self, interval:float):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self, interval:float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"salt keyring refresh failed: {e}")
+
+
+salt_keyring = SaltKeyring(min_reload_interval=settings.SALT_KEYRING_MIN_RELOAD_SECONDS)
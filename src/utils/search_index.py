@@ -0,0 +1,132 @@
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# same weights as setweight A/B/C on the search_vector column
+FIELD_WEIGHTS = {"server_name": 1.0, "description": 0.4, "author": 0.2}
+TRIGRAM_FIELDS = ("server_name", "author")
+# pg_trgm's default similarity threshold for the % operator
+SIMILARITY_THRESHOLD = 0.3
+# every column of a server except server_api_key, which must never show up in search results
+PUBLIC_SERVER_FIELDS = ("server_id", "server_name", "description", "author", "version", "server_url", "server_type", "owned_by", "created_at")
+
+
+def tokenize(value:str) -> list:
+    return TOKEN_PATTERN.findall((value or "").lower())
+
+def prefix_tsquery(query:str) -> str:
+    """"github iss" -> "github:* & iss:*", every term has to match the start of a word"""
+    return " & ".join(f"{term}:*" for term in tokenize(query))
+
+def trigrams(value:str) -> set:
+    """Trigrams the way pg_trgm builds them: per word, padded with two spaces in front and one after"""
+    grams = set()
+    for word in tokenize(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def similarity(left:set, right:set) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+def public_server(server) -> dict:
+    return {field: getattr(server, field) for field in PUBLIC_SERVER_FIELDS}
+
+
+class SearchIndex:
+    """In-process stand-in for the Postgres search: weighted prefix matching over server_name, description and
+    author plus trigram similarity on server_name and author. Used where pg_trgm is not available."""
+
+    def __init__(self):
+        self._servers = {}
+        self._postings = defaultdict(dict)  # token -> {server_id: weight}
+        self._tokens = []  # sorted, prefix lookups are a bisect
+        self._trigram_postings = defaultdict(set)
+        self._server_trigrams = {}
+
+    def __len__(self):
+        return len(self._servers)
+
+    def load(self, servers):
+        for server in servers:
+            self.add(server)
+
+    def add(self, server:dict):
+        server_id = server["server_id"]
+        self.remove(server_id)
+        self._servers[server_id] = server
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(server.get(field)):
+                postings = self._postings[token]
+                if not postings:
+                    insort(self._tokens, token)
+                postings[server_id] = max(postings.get(server_id, 0.0), weight)
+        field_trigrams = {field: trigrams(server.get(field)) for field in TRIGRAM_FIELDS}
+        self._server_trigrams[server_id] = field_trigrams
+        for grams in field_trigrams.values():
+            for gram in grams:
+                self._trigram_postings[gram].add(server_id)
+
+    def remove(self, server_id:str):
+        server = self._servers.pop(server_id, None)
+        if server is None:
+            return
+        for field in FIELD_WEIGHTS:
+            for token in tokenize(server.get(field)):
+                postings = self._postings.get(token)
+                if postings is None:
+                    continue
+                postings.pop(server_id, None)
+                if not postings:
+                    del self._postings[token]
+                    del self._tokens[bisect_left(self._tokens, token)]
+        for grams in self._server_trigrams.pop(server_id).values():
+            for gram in grams:
+                self._trigram_postings[gram].discard(server_id)
+                if not self._trigram_postings[gram]:
+                    del self._trigram_postings[gram]
+
+    def _prefix_matches(self, term:str) -> dict:
+        matches = {}
+        index = bisect_left(self._tokens, term)
+        while index < len(self._tokens) and self._tokens[index].startswith(term):
+            for server_id, weight in self._postings[self._tokens[index]].items():
+                matches[server_id] = max(matches.get(server_id, 0.0), weight)
+            index += 1
+        return matches
+
+    def search(self, query:str, server_type:str = None, version:str = None, limit:int = 20) -> list:
+        scores = {}
+        terms = tokenize(query)
+        if terms:
+            # every term has to match, like the & of the tsquery
+            matched = self._prefix_matches(terms[0])
+            for term in terms[1:]:
+                term_matches = self._prefix_matches(term)
+                matched = {server_id: weight + term_matches[server_id] for server_id, weight in matched.items() if server_id in term_matches}
+            scores.update(matched)
+        query_trigrams = trigrams(query)
+        candidates = set()
+        for gram in query_trigrams:
+            candidates |= self._trigram_postings.get(gram, set())
+        for server_id in candidates:
+            best = max(similarity(query_trigrams, grams) for grams in self._server_trigrams[server_id].values())
+            if best >= SIMILARITY_THRESHOLD:
+                scores[server_id] = max(scores.get(server_id, 0.0), best)
+
+        results = []
+        for server_id, score in scores.items():
+            server = self._servers[server_id]
+            if server_type and server["server_type"] != server_type:
+                continue
+            if version and server["version"] != version:
+                continue
+            results.append((score, server))
+        results.sort(key=lambda item: (-item[0], item[1]["server_name"]))
+        return [dict(server, score=round(score, 4)) for score, server in results[:limit]]
+
+
+server_search_index = SearchIndex()
@@ -0,0 +1,28 @@
+import time
+from utils.logger import logger
+
+
+class StartupTimer:
+    """Time spent in each lifespan step, logged once the app is ready to serve.
+    started_at is a perf_counter reading taken when main was imported, the imports become the first phase."""
+
+    def __init__(self, started_at:float = None):
+        now = time.perf_counter()
+        self.started = started_at if started_at is not None else now
+        self._last = now
+        self.phases = {}
+        if started_at is not None:
+            self.phases["imports"] = round((now - started_at) * 1000, 1)
+
+    def mark(self, name:str):
+        now = time.perf_counter()
+        self.phases[name] = round((now - self._last) * 1000, 1)
+        self._last = now
+
+    def report(self) -> dict:
+        return {"total_ms": round((self._last - self.started) * 1000, 1), "phases": self.phases}
+
+    def log(self):
+        report = self.report()
+        phases = ", ".join(f"{name}={ms}ms" for name, ms in report["phases"].items())
+        logger.info(f"startup took {report['total_ms']}ms: {phases}")
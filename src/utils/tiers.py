@@ -0,0 +1,101 @@
+import logging
+from typing import Optional
+from sqlalchemy import select
+import models
+from utils.cache import TTLCache
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIER = "free"
+REDIS_PREFIX = "tier:"
+
+
+class TierStore:
+    """Tier per "user:<user_id>" and per "key:<api key digest>".
+
+    Entries are shared between workers in Redis for ttl seconds and each process keeps a copy for local_ttl
+    seconds in front of that, so most rate limit decisions need neither Redis nor the DB. User tiers are read
+    from the user record, a tier claim in a JWT is not trusted since it outlives a change of tier. API key tiers
+    are stored when a key passes validation. Without Redis, or when it fails, only the local copy is used."""
+
+    def __init__(self, maxsize:int, ttl:float, local_ttl:float):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self.redis = None
+        self.db_loads = 0
+        self.errors = 0
+
+    def bind(self, redis):
+        self.redis = redis
+
+    async def get(self, key:str) -> Optional[str]:
+        tier = self.local.get(key)
+        if tier is not None or self.redis is None:
+            return tier
+        try:
+            tier = await self.redis.get(f"{REDIS_PREFIX}{key}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"tier lookup failed for {key}: {e}")
+            return None
+        if tier is not None:
+            self.local.set(key, tier)
+        return tier
+
+    async def set(self, key:str, tier:str):
+        self.local.set(key, tier)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"{REDIS_PREFIX}{key}", tier, ex=int(self.ttl))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"storing the tier failed for {key}: {e}")
+
+    async def remember_user(self, user_id:str, tier:str):
+        if user_id and tier:
+            await self.set(f"user:{user_id}", tier)
+
+    async def remember_api_key(self, api_key_digest:str, tier:str):
+        # stored for every key that passed validation, the rate limiter only trusts keys found here
+        await self.set(f"key:{api_key_digest}", tier or DEFAULT_TIER)
+
+    async def user_tier(self, user_id:str, access_type:str = None) -> str:
+        if not user_id:
+            return DEFAULT_TIER
+        key = f"user:{user_id}"
+        tier = await self.get(key)
+        if tier is None:
+            tier = await self._load_user_tier(user_id, access_type)
+            if tier is None:
+                return DEFAULT_TIER
+            await self.set(key, tier)
+        return tier
+
+    async def api_key_tier(self, api_key_digest:str) -> Optional[str]:
+        """Tier of a key that passed validation on any worker recently, None for any other key"""
+        return await self.get(f"key:{api_key_digest}")
+
+    async def _load_user_tier(self, user_id:str, access_type:str = None) -> Optional[str]:
+        # provider accounts live in their own table, every other token belongs to a user
+        model = models.ProviderUser if access_type == "provider" else models.User
+        self.db_loads += 1
+        try:
+            async with models.get_sessionmaker()() as db:
+                tier = (await db.execute(select(model.tier).filter(model.user_id == user_id))).scalar()
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"loading the tier of user {user_id} failed: {e}")
+            return None
+        return tier or DEFAULT_TIER
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats(),
+            "db_loads": self.db_loads,
+            "errors": self.errors
+        }
+
+
+tier_store = TierStore(maxsize=settings.TIER_CACHE_SIZE, ttl=settings.TIER_CACHE_TTL_SECONDS, local_ttl=settings.TIER_LOCAL_TTL_SECONDS)
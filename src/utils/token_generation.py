@@ -6,13 +6,30 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 import base64
 import json
-from utils.logger import logger
+import hashlib
+import time
+import logging
+from utils.worker_pool import BoundedWorkerPool, WorkerPoolSaturated
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 UPLOADS_DIR = "uploads"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# bcrypt takes hundreds of milliseconds per call, it runs here instead of on the event loop
+password_pool = BoundedWorkerPool(
+    "password_hashing",
+    kind=settings.PASSWORD_POOL_KIND,
+    max_workers=settings.PASSWORD_POOL_WORKERS,
+    max_queue=settings.PASSWORD_POOL_MAX_QUEUE
+)
+
+# Claims of tokens that already passed verification, keyed by a digest of the token and expiring with it
+verified_token_cache = TTLCache(maxsize=settings.JWT_CACHE_SIZE, ttl=settings.JWT_CACHE_MAX_TTL_SECONDS)
+
 def create_token(user_data:dict):
     try:
         to_encode = user_data.copy()
@@ -27,38 +44,49 @@ def create_token(user_data:dict):
     except JWTError as e:
         raise Exception(f"Failed to create token: {str(e)}")
 
-async def validate_token(token:str, credential_exception):
+def verify_jwt(token:str) -> dict:
+    """Decodes and verifies the token, tokens seen before are served from verified_token_cache"""
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    payload = verified_token_cache.get(digest)
+    if payload is not None and payload["exp"] > now:
+        return payload
+    #change has been made in key for all auths if it doesnt work remove secrets from paramters and key and replace it with settings.SECRET_KEY_J
+    payload = jwt.decode(
+        token=token,
+        key=settings.SECRET_KEY_J,
+        algorithms=settings.ALGORITHM
+        )
+    exp = payload.get("exp")
+    if not exp or exp < now:
+        raise JWTError("token expired")
+    verified_token_cache.set(digest, payload, ttl=min(exp - now, settings.JWT_CACHE_MAX_TTL_SECONDS))
+    return payload
+
+def get_token_claims(token:str, request:Request = None) -> dict:
+    """Verified claims memoized on request.state so the limiter and the route dependencies share one check"""
+    if request is not None:
+        memo = getattr(request.state, "token_claims", None)
+        if memo is not None and memo[0] == token:
+            return memo[1]
+    payload = verify_jwt(token)
+    if request is not None:
+        request.state.token_claims = (token, payload)
+    return payload
+
+async def validate_token(token:str, credential_exception, request:Request = None):
     try:
         if not token:
             raise Exception(f"No token provided in the header")
-    #change has been made in key for all auths if it doesnt work remove secrets from paramters and key and replace it with settings.SECRET_KEY_J
-        payload = jwt.decode(
-            token=token,
-            key=settings.SECRET_KEY_J,
-            algorithms=settings.ALGORITHM
-            )
-        
-        exp = payload.get("exp")
-        if not exp or datetime.fromtimestamp(exp, tz=timezone.utc)<datetime.now(timezone.utc):
-            raise credential_exception
-        return payload
+        return get_token_claims(token, request)
     except JWTError:
         raise credential_exception
 
-async def validate_token_incoming_requests(token:str):
+async def validate_token_incoming_requests(token:str, request:Request = None):
     try:
         if not token:
             raise Exception(f"No token provided in the header")
-    #change has been made in key for all auths if it doesnt work remove secrets from paramters and key and replace it with settings.SECRET_KEY_J
-        payload = jwt.decode(
-            token=token,
-            key=settings.SECRET_KEY_J,
-            algorithms=settings.ALGORITHM
-            )
-        exp = payload.get("exp")
-        if not exp or datetime.fromtimestamp(exp, tz=timezone.utc)<datetime.now(timezone.utc):
-            raise Exception(f"token expired")
-        return payload
+        return get_token_claims(token, request)
     except JWTError as e:
         raise Exception(f"failed to validate token: {str(e)}")
     
@@ -69,18 +97,29 @@ def get_current_user(token: HTTPAuthorizationCredentials = Security(security)):
 async def token_validator(request: Request,token: HTTPAuthorizationCredentials = Security(security)):
 
     
-    logger.info(f"request headers: {request.headers}")
-    logger.info(f"token: {token}")
-    regular_token = await validate_app_user(token = token.credentials)
+    logger.debug(f"token_validator called for {request.url.path}")
+    regular_token = await validate_app_user(token = token.credentials, request=request)
     return {"regular_login_token": regular_token}
 
-def hash_passwords(password:str):
+def _hash_password(password:str):
     return pwd_context.hash(password)
 
-def verify_password(password:str, hashed_password:str):
-    [print(f"password: {password}, hashed_password: {hashed_password}")]
+def _verify_password(password:str, hashed_password:str):
     return pwd_context.verify(password,hashed_password)
 
+async def run_on_password_pool(fn, *args):
+    try:
+        return await password_pool.run(fn, *args)
+    except WorkerPoolSaturated as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Service is busy, please try again shortly", headers={"Retry-After": "1"})
+
+async def hash_passwords(password:str):
+    return await run_on_password_pool(_hash_password, password)
+
+async def verify_password(password:str, hashed_password:str):
+    return await run_on_password_pool(_verify_password, password, hashed_password)
+
 
 def validate_jira_token(token: str):
     """Validate Jira-specific JWT token"""
@@ -128,17 +167,12 @@ class TokenDecoder:
             logger.error(f"Error decoding token: {str(e)}")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token format")
 
-async def validate_app_user(token:str):
+async def validate_app_user(token:str, request:Request = None):
     """Validate the app's JWT token"""
     credential_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
     try:
         # token = credentials.credentials
         token = token
-        logger.info(f"token: {token}")
-        token_decoder = TokenDecoder()
-        payload = await token_decoder.decode_oauth_token(token=token)
-        logger.info(f"payload: {payload}")
-
-        return await validate_token(token=token, credential_exception=credential_exception)
+        return await validate_token(token=token, credential_exception=credential_exception, request=request)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"error {str(e)}")
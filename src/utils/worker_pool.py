@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.logger import logger
+from utils.metrics import WORKER_POOL_WAIT, WORKER_POOL_REJECTED
+
+
+class WorkerPoolSaturated(Exception):
+    pass
+
+
+def _timed_call(fn, args):
+    # runs in the worker, time.monotonic is system wide so the start time is comparable across processes
+    return time.monotonic(), fn(*args)
+
+
+class BoundedWorkerPool:
+    """Runs blocking calls on a thread or process pool so they stay off the event loop.
+    At most max_workers calls run and max_queue wait, anything beyond that is rejected straight away."""
+
+    def __init__(self, name:str, kind:str = "thread", max_workers:int = 4, max_queue:int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError("Invalid pool kind it can only be thread or process")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    def start(self):
+        if self._executor is None:
+            executor_class = ThreadPoolExecutor if self.kind == "thread" else ProcessPoolExecutor
+            self._executor = executor_class(max_workers=self.max_workers)
+            logger.info(f"{self.name} pool started with {self.max_workers} {self.kind} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            WORKER_POOL_REJECTED.inc((self.name,))
+            raise WorkerPoolSaturated(f"{self.name} pool is saturated, {self.in_flight} calls in flight")
+        self.start()
+        self.in_flight += 1
+        submitted_at = time.monotonic()
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(self._executor, _timed_call, fn, args)
+        finally:
+            self.in_flight -= 1
+        wait_time = max(0.0, started_at - submitted_at)
+        self.completed += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        WORKER_POOL_WAIT.observe(wait_time, (self.name,))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_time_avg_ms": round(self.wait_time_total / self.completed * 1000, 3) if self.completed else 0.0,
+            "wait_time_max_ms": round(self.wait_time_max * 1000, 3)
+        }
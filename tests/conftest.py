@@ -0,0 +1,8 @@
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# tests import the app modules the same way uvicorn does when started from src/
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,79 @@
+import asyncio
+import random
+
+
+class FakePipeline:
+    """The pipeline commands the hybrid limiter uses, applied when execute runs after a random delay
+    so pipelines of concurrent syncs can overtake each other"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def incrby(self, key, amount):
+        self.commands.append(("incrby", key, amount))
+
+    def expire(self, key, ttl):
+        self.commands.append(("expire", key, ttl))
+
+    def get(self, key):
+        self.commands.append(("get", key))
+
+    async def execute(self):
+        await asyncio.sleep(random.random() * self.redis.max_latency)
+        results = []
+        for command, key, *args in self.commands:
+            if command == "incrby":
+                self.redis.data[key] = self.redis.data.get(key, 0) + args[0]
+                results.append(self.redis.data[key])
+            elif command == "expire":
+                results.append(True)
+            else:
+                results.append(self.redis.data.get(key))
+        return results
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, []).append(self.messages)
+
+    async def get_message(self, ignore_subscribe_messages:bool = False, timeout:float = 0.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        for queues in self.redis.subscribers.values():
+            if self.messages in queues:
+                queues.remove(self.messages)
+
+
+class FakeRedis:
+    def __init__(self, max_latency:float = 0.002):
+        self.data = {}
+        self.max_latency = max_latency
+        self.subscribers = {}
+
+    def pipeline(self, transaction:bool = False):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex = None):
+        self.data[key] = value
+        return True
+
+    async def publish(self, channel, message):
+        queues = self.subscribers.get(channel, [])
+        for queue in queues:
+            queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(queues)
+
+    def pubsub(self):
+        return FakePubSub(self)
@@ -0,0 +1,80 @@
+from utils.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds:float):
+        self.now += seconds
+
+
+def test_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("key", "value")
+    clock.advance(59.9)
+    assert cache.get("key") == "value"
+    clock.advance(0.1)
+    assert cache.get("key") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_overrides_default():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("negative", "not_found", ttl=5)
+    cache.set("positive", "valid")
+    clock.advance(5)
+    assert cache.get("negative") is None
+    assert cache.get("positive") == "valid"
+
+
+def test_zero_ttl_is_not_stored():
+    cache = TTLCache(maxsize=10, ttl=60, clock=FakeClock())
+    cache.set("key", "value", ttl=0)
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # reading a makes b the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_overwrite_does_not_evict():
+    cache = TTLCache(maxsize=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 3)
+    assert cache.get("a") == 3
+    assert cache.get("b") == 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_invalidate_tag_drops_every_tagged_entry():
+    cache = TTLCache(maxsize=10, ttl=60, clock=FakeClock())
+    cache.set("key-1", "valid", tag="project-1")
+    cache.set("key-2", "valid", tag="project-1")
+    cache.set("key-3", "valid", tag="project-2")
+    assert cache.invalidate_tag("project-1") == 2
+    assert cache.get("key-1") is None and cache.get("key-2") is None
+    assert cache.get("key-3") == "valid"
+
+
+def test_evicted_entry_leaves_its_tag():
+    cache = TTLCache(maxsize=1, ttl=60, clock=FakeClock())
+    cache.set("key-1", "valid", tag="project-1")
+    cache.set("key-2", "valid")
+    assert cache.invalidate_tag("project-1") == 0
@@ -0,0 +1,62 @@
+import asyncio
+from fakes import FakeRedis
+from utils.cache import TTLCache
+from utils.cache_invalidation import CacheInvalidator
+
+
+def make_worker(redis) -> tuple:
+    cache = TTLCache(maxsize=10, ttl=60)
+    invalidator = CacheInvalidator(poll_timeout=0.01, retry_interval=0.01)
+    invalidator.register("api_keys", cache)
+    invalidator.bind(redis)
+    return cache, invalidator
+
+
+def test_invalidation_reaches_every_worker():
+    async def scenario():
+        redis = FakeRedis()
+        workers = [make_worker(redis) for _ in range(3)]
+        for cache, invalidator in workers:
+            cache.set("key-1", "valid", tag="project-1")
+            cache.set("key-2", "valid", tag="project-2")
+            invalidator.start()
+        await asyncio.sleep(0.02)
+        await workers[0][1].invalidate("api_keys", "project-1")
+        await asyncio.sleep(0.05)
+        for _, invalidator in workers:
+            await invalidator.stop()
+        return [(cache.get("key-1"), cache.get("key-2")) for cache, _ in workers]
+
+    assert asyncio.run(scenario()) == [(None, "valid")] * 3
+
+
+def test_caches_are_cleared_after_a_lost_subscription():
+    class FlakyRedis(FakeRedis):
+        def __init__(self):
+            super().__init__()
+            self.failures = 1
+
+        def pubsub(self):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("redis is down")
+            return super().pubsub()
+
+    async def scenario():
+        cache, invalidator = make_worker(FlakyRedis())
+        cache.set("key-1", "valid", tag="project-1")
+        invalidator.start()
+        await asyncio.sleep(0.05)
+        await invalidator.stop()
+        return cache.get("key-1"), invalidator.resubscribes
+
+    # the invalidation of project-1 may have been published while the worker wasn't listening
+    assert asyncio.run(scenario()) == (None, 1)
+
+
+def test_without_redis_only_the_local_copy_is_invalidated():
+    cache, invalidator = make_worker(None)
+    cache.set("key-1", "valid", tag="project-1")
+    asyncio.run(invalidator.invalidate("api_keys", "project-1"))
+    assert cache.get("key-1") is None
+    assert invalidator.published == 0
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from fakes import FakeRedis
+from routers.provider_services import server_details
+from utils.response_cache import ResponseCache, GET_SCRIPT
+
+
+class ScriptRedis(FakeRedis):
+    """Runs GET_SCRIPT against the fake's data and counts the round trips"""
+
+    def __init__(self):
+        super().__init__()
+        self.round_trips = 0
+
+    def register_script(self, script):
+        async def get_script(keys, args):
+            self.round_trips += 1
+            version = self.data.setdefault(keys[0], str(args[1]))
+            return [version, self.data.get(f"{args[0]}{version}:{args[2]}")]
+
+        async def other_script(keys, args):
+            self.round_trips += 1
+
+        return get_script if script == GET_SCRIPT else other_script
+
+    async def get(self, key):
+        self.round_trips += 1
+        return await super().get(key)
+
+    async def set(self, key, value, ex = None, nx:bool = False, px = None):
+        self.round_trips += 1
+        if nx and key in self.data:
+            return None
+        return await super().set(key, value)
+
+
+def make_cache() -> tuple:
+    redis = ScriptRedis()
+    cache = ResponseCache("catalog", ttl=60, lock_ttl=5, lock_wait=0.2)
+    cache.bind(redis)
+    return cache, redis
+
+
+def test_cached_body_and_version_come_back_in_one_round_trip():
+    cache, redis = make_cache()
+
+    async def loader():
+        return {"servers": []}
+
+    async def scenario():
+        version, payload = await cache.read("owner-1", "servers")
+        assert payload is None
+        await cache.load("owner-1", "servers", version, loader)
+        redis.round_trips = 0
+        return version, await cache.read("owner-1", "servers")
+
+    version, (cached_version, payload) = asyncio.run(scenario())
+    assert (cached_version, payload) == (version, '{"servers":[]}')
+    assert redis.round_trips == 1
+
+
+def test_server_api_key_is_not_in_the_cached_body():
+    server = SimpleNamespace(
+        server_id="server-1", server_name="github", description="issues", author="octo", version="1.0",
+        server_url="https://example.com", server_type="remote", server_api_key="secret", owned_by="owner-1",
+        modified_by="owner-1", modified_at=datetime(2026, 1, 1), created_at=datetime(2026, 1, 1),
+        )
+    details = server_details(server)
+    assert "server_api_key" not in details
+    assert "secret" not in ResponseCache.encode(details)
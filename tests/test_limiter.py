@@ -0,0 +1,112 @@
+import asyncio
+import random
+from fakes import FakeRedis
+from utils.limiter import HybridRateLimiter, MemoryRateLimiter
+
+
+async def admitted(workers:int, limit:int, requests:int, cost:int = 1) -> int:
+    redis = FakeRedis()
+    limiters = [HybridRateLimiter(redis, sync_interval=0.05, overshoot=0.1, workers=workers) for _ in range(workers)]
+    for limiter in limiters:
+        limiter.start()
+    total = 0
+
+    async def one_request(i:int):
+        nonlocal total
+        await asyncio.sleep(random.random() * 0.05)
+        result = await limiters[i % workers].hit("key", limit, 60, cost)
+        total += cost if result.allowed else 0
+
+    await asyncio.gather(*(one_request(i) for i in range(requests)))
+    for limiter in limiters:
+        await limiter.stop()
+    return total
+
+
+def test_hybrid_single_worker_is_exact():
+    assert asyncio.run(admitted(workers=1, limit=100, requests=400)) == 100
+
+
+def test_hybrid_overshoot_is_bounded_across_workers():
+    # each worker may run limit * overshoot / workers ahead of the others, 10 in total
+    for workers in (2, 4):
+        assert 100 <= asyncio.run(admitted(workers=workers, limit=100, requests=400)) <= 110
+
+
+def test_hybrid_unsynced_budget_is_split_between_workers():
+    limiter = HybridRateLimiter(FakeRedis(), overshoot=0.1, workers=4)
+    assert limiter.unsynced_budget(100) == 2
+    assert limiter.unsynced_budget(10) == 1
+
+
+def test_hybrid_cost_is_charged_in_full():
+    async def scenario():
+        limiter = HybridRateLimiter(FakeRedis())
+        first = await limiter.hit("key", 10, 60, cost=6)
+        second = await limiter.hit("key", 10, 60, cost=6)
+        third = await limiter.hit("key", 10, 60, cost=4)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first.allowed and first.remaining == 4
+    assert not second.allowed
+    assert third.allowed and third.remaining == 0
+
+
+def test_gcra_allows_a_full_burst_then_refuses():
+    limiter = MemoryRateLimiter()
+    # 10 per minute, one token every 6 seconds
+    results = [limiter.hit_now("key", 10, 60, now=0) for _ in range(11)]
+    assert all(result.allowed for result in results[:10])
+    assert [result.remaining for result in results[:10]] == list(range(9, -1, -1))
+    assert not results[10].allowed
+    assert results[10].remaining == 0
+
+
+def test_gcra_retry_after_is_the_time_until_the_next_token():
+    limiter = MemoryRateLimiter()
+    for _ in range(10):
+        limiter.hit_now("key", 10, 60, now=0)
+    refused = limiter.hit_now("key", 10, 60, now=1000)
+    assert not refused.allowed
+    assert refused.retry_after == 5.0
+    assert refused.reset_after == 59.0
+    assert refused.headers()["Retry-After"] == "5"
+
+
+def test_gcra_refills_one_token_per_interval():
+    limiter = MemoryRateLimiter()
+    for _ in range(10):
+        limiter.hit_now("key", 10, 60, now=0)
+    assert not limiter.hit_now("key", 10, 60, now=5999).allowed
+    refilled = limiter.hit_now("key", 10, 60, now=6000)
+    assert refilled.allowed and refilled.remaining == 0
+    assert not limiter.hit_now("key", 10, 60, now=6000).allowed
+    # after a full period the whole burst is available again
+    assert limiter.hit_now("key", 10, 60, now=72000).remaining == 9
+
+
+def test_gcra_refused_hit_does_not_consume():
+    limiter = MemoryRateLimiter()
+    for _ in range(10):
+        limiter.hit_now("key", 10, 60, now=0)
+    for _ in range(5):
+        limiter.hit_now("key", 10, 60, now=1000)
+    assert limiter.hit_now("key", 10, 60, now=6000).allowed
+
+
+def test_gcra_cost_takes_several_tokens():
+    limiter = MemoryRateLimiter()
+    assert limiter.hit_now("key", 10, 60, now=0, cost=4).remaining == 6
+    assert not limiter.hit_now("key", 10, 60, now=0, cost=7).allowed
+    assert limiter.hit_now("key", 10, 60, now=0, cost=6).allowed
+
+
+def test_gcra_keys_are_independent_and_bounded():
+    limiter = MemoryRateLimiter(max_keys=2)
+    for _ in range(10):
+        limiter.hit_now("a", 10, 60, now=0)
+    assert limiter.hit_now("b", 10, 60, now=0).allowed
+    limiter.hit_now("c", 10, 60, now=0)
+    # a was the least recently used key and got dropped with its state
+    assert limiter.hit_now("a", 10, 60, now=0).allowed
@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from utils.pagination import encode_cursor, decode_cursor, cached_next_cursor, cursor_headers
+from utils.response_cache import ResponseCache
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(created_at, "row-1")) == (created_at, "row-1")
+
+
+def test_invalid_cursor_is_a_400():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("not-a-cursor")
+    assert error.value.status_code == 400
+
+
+def test_next_cursor_is_read_back_from_a_cached_page():
+    cursor = encode_cursor(datetime(2026, 1, 2, tzinfo=timezone.utc), "row-1")
+    payload = ResponseCache.encode({"next_cursor": cursor, "status": "Success", "servers": [{"next_cursor": "decoy"}]})
+    assert cached_next_cursor(payload) == cursor
+    assert cached_next_cursor(ResponseCache.encode({"next_cursor": None, "servers": []})) is None
+    assert cached_next_cursor(ResponseCache.encode({"status": "Success"})) is None
+
+
+def test_cursor_headers_skip_missing_values():
+    assert cursor_headers("abc", "etag") == {"X-Next-Cursor": "abc", "ETag": "etag"}
+    assert cursor_headers(None, None) == {}
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from p_model_type import Project, ProjectBulk, ApiKeyBatch
+from routers import project_services
+from routers.project_services import serialize_permissions, violated_constraint, API_KEY_CONSTRAINTS, PROJECT_NAME_CONSTRAINT
+from utils.keygeneration import mask_key
+
+
+class DriverError(Exception):
+    def __init__(self, constraint_name:str):
+        super().__init__(f"violates {constraint_name}")
+        self.constraint_name = constraint_name
+
+
+class AdaptedError(Exception):
+    """What sqlalchemy's asyncpg adapter puts in IntegrityError.orig, the driver error is its __cause__"""
+
+
+def integrity_error(constraint_name:str) -> IntegrityError:
+    adapted = AdaptedError("integrity error")
+    adapted.__cause__ = DriverError(constraint_name)
+    return IntegrityError("INSERT ...", {}, adapted)
+
+
+def test_violated_constraint_reads_the_driver_error():
+    assert violated_constraint(integrity_error(PROJECT_NAME_CONSTRAINT)) == PROJECT_NAME_CONSTRAINT
+
+
+def test_permissions_are_stored_as_json_text():
+    assert serialize_permissions(["read", "write,admin"]) == '["read", "write,admin"]'
+    assert serialize_permissions([]) == "[]"
+    assert serialize_permissions(None) is None
+
+def test_only_key_indexes_count_as_key_collisions():
+    assert violated_constraint(integrity_error("ix_auth_project_details_key_id")) in API_KEY_CONSTRAINTS
+    assert violated_constraint(integrity_error("project_details_user_id_fkey")) not in API_KEY_CONSTRAINTS
+    assert violated_constraint(IntegrityError("INSERT ...", {}, Exception("no constraint name"))) not in API_KEY_CONSTRAINTS
+
+
+USER = {"regular_login_token": {"access_type": "user", "id": "user-1"}}
+
+
+class SaltVersion:
+    version_id = "version-1"
+    version_name = "v1"
+    template = None
+
+
+class FakeSession:
+    def __init__(self, error:Exception = None):
+        self.error = error
+        self.executed = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def execute(self, statement):
+        self.executed += 1
+        raise self.error
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def salt_version(monkeypatch):
+    monkeypatch.setattr(project_services.salt_keyring, "choose_active", lambda: SaltVersion())
+    monkeypatch.setattr(project_services.salt_keyring, "hash", lambda entry, api_key: f"hash-{api_key}")
+
+
+def test_bulk_reports_invalid_items_one_by_one(salt_version):
+    request = ProjectBulk(projects=[
+        Project(name="alpha", server_environment="staging"),
+        Project(name=""),
+        ])
+    db = FakeSession()
+    response = asyncio.run(project_services.create_projects_bulk(request, db, USER))
+    assert response["created"] == 0
+    assert [result["status"] for result in response["results"]] == ["invalid", "invalid"]
+    assert "server environment" in response["results"][0]["detail"]
+    assert db.executed == 0
+
+
+def test_bulk_does_not_retry_other_constraint_violations(salt_version):
+    request = ProjectBulk(projects=[Project(name="alpha")])
+    db = FakeSession(error=integrity_error("project_user_id_fkey"))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(project_services.create_projects_bulk(request, db, USER))
+    assert error.value.status_code == 400
+    assert db.executed == 1
+
+
+def test_bulk_retries_key_collisions(salt_version):
+    request = ProjectBulk(projects=[Project(name="alpha")])
+    db = FakeSession(error=integrity_error("ix_auth_project_details_key_id"))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(project_services.create_projects_bulk(request, db, USER))
+    assert error.value.status_code == 500
+    assert db.executed == project_services.PROJECT_KEY_ATTEMPTS
+
+
+class Rows:
+    def __init__(self, rows:list):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class ScriptedSession(FakeSession):
+    """Answers each execute with the next list of rows"""
+
+    def __init__(self, *results):
+        super().__init__()
+        self.results = list(results)
+
+    async def execute(self, statement):
+        self.executed += 1
+        return Rows(self.results.pop(0))
+
+
+def key_row(project_id:str, api_key:str, key_id:str = None, matching:bool = True):
+    return SimpleNamespace(
+        project_id=project_id,
+        user_id="user-1",
+        key_id=key_id,
+        salt_version_id="version-1",
+        msecret_key=mask_key(api_key),
+        secret_key_hash=f"hash-{api_key}" if matching else "hash-of-another-key",
+        )
+
+
+@pytest.fixture
+def keyring(monkeypatch):
+    async def resolve(version_id:str = None, version_name:str = None):
+        return SaltVersion()
+
+    monkeypatch.setattr(project_services.salt_keyring, "resolve", resolve)
+    monkeypatch.setattr(project_services.salt_keyring, "hash", lambda entry, api_key: f"hash-{api_key}")
+    project_services.api_key_cache.clear()
+
+
+def test_legacy_key_is_found_by_mask_when_its_key_id_was_reused(keyring):
+    api_key = "ak-dev-alph-0a1b2c3d.legacy-token"
+    newer = key_row("project-new", "ak-dev-beta-0a1b2c3d.newer-token", key_id="0a1b2c3d", matching=False)
+    legacy = key_row("project-legacy", api_key)
+    db = ScriptedSession([(newer, "free")], [(legacy, "pro")])
+    result = asyncio.run(project_services.get_api_key_details(api_key, db))
+    assert result["status"] == "valid" and result["project_id"] == "project-legacy"
+    assert db.executed == 2
+    # the key id belongs to the newer row, storing it on the legacy row would violate the unique index
+    assert legacy.key_id is None and db.commits == 0
+
+
+def test_every_legacy_row_sharing_a_mask_is_checked(keyring):
+    api_key = "ak-dev-alph-1a1b2c3d.legacy-token"
+    db = ScriptedSession([], [(key_row("project-a", api_key, matching=False), "free"), (key_row("project-b", api_key), "free")])
+    result = asyncio.run(project_services.get_api_key_details(api_key, db))
+    assert result["project_id"] == "project-b"
+    assert db.commits == 1
+
+
+def test_batch_falls_back_to_the_mask_when_the_key_id_row_does_not_verify(keyring):
+    reused = "ak-dev-alph-2a1b2c3d.legacy-token"
+    current = "ak-dev-beta-3a1b2c3d.current-token"
+    db = ScriptedSession(
+        [(key_row("project-new", "ak-dev-gamm-2a1b2c3d.newer-token", key_id="2a1b2c3d", matching=False), "free"),
+         (key_row("project-current", current, key_id="3a1b2c3d"), "free")],
+        [(key_row("project-legacy", reused), "free")],
+        )
+    http_request = SimpleNamespace(state=SimpleNamespace())
+    response = asyncio.run(project_services.validate_api_keys_batch(ApiKeyBatch(api_keys=[reused, current]), http_request, db))
+    assert [result["project_id"] for result in response["results"]] == ["project-legacy", "project-current"]
+    assert db.executed == 2
@@ -0,0 +1,74 @@
+import asyncio
+import secrets
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from fakes import FakeRedis
+from utils.keygeneration import api_key_digest
+from utils.limiter import MemoryRateLimiter
+from utils.middleware import RateLimitMiddleware
+from utils.rate_limit import resolve_tier
+from utils.tiers import TierStore, tier_store
+
+# free callers get 30 requests a minute on default routes
+FREE_LIMIT = 30
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware)
+    app.state.rate_limiter = MemoryRateLimiter()
+
+    @app.get("/api/v1/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    return TestClient(app)
+
+
+def refused(client:TestClient, requests:int, headers = None) -> int:
+    return sum(client.get("/api/v1/ping", headers=headers() if headers else None).status_code == 429 for _ in range(requests))
+
+
+def setup_function():
+    tier_store.local.clear()
+
+
+def test_requests_without_key_share_the_ip_bucket():
+    assert refused(make_client(), FREE_LIMIT + 10) == 10
+
+
+def test_random_api_keys_fall_back_to_the_ip_bucket():
+    client = make_client()
+    assert refused(client, FREE_LIMIT + 10, headers=lambda: {"api-key": f"ak-dev-test-{secrets.token_hex(4)}.{secrets.token_urlsafe(8)}"}) == 10
+
+
+def test_validated_api_key_gets_its_own_bucket():
+    client = make_client()
+    api_key = "ak-dev-test-0a1b2c3d.validated"
+    asyncio.run(tier_store.remember_api_key(api_key_digest(api_key), None))
+    assert refused(client, FREE_LIMIT, headers=lambda: {"api-key": api_key}) == 0
+    # the key's requests were not charged to the IP bucket
+    assert refused(client, FREE_LIMIT) == 0
+    assert refused(client, 1, headers=lambda: {"api-key": api_key}) == 1
+
+
+def test_token_tier_claim_is_not_trusted(monkeypatch):
+    async def load_user_tier(user_id:str, access_type:str = None):
+        return "free"
+
+    monkeypatch.setattr(tier_store, "_load_user_tier", load_user_tier)
+    request = Request({"type": "http", "method": "GET", "path": "/api/v1/ping", "headers": []})
+    # a token issued before the user was moved down still says premium
+    request.state.token_claims = ("token", {"id": "user-1", "tier": "premium"})
+    assert asyncio.run(resolve_tier(request)) == "free"
+
+
+def test_validated_api_key_is_known_to_every_worker():
+    redis = FakeRedis()
+    workers = [TierStore(maxsize=10, ttl=60, local_ttl=10) for _ in range(2)]
+    for worker in workers:
+        worker.bind(redis)
+    digest = api_key_digest("ak-dev-test-0a1b2c3d.validated")
+    asyncio.run(workers[0].remember_api_key(digest, "premium"))
+    assert asyncio.run(workers[1].api_key_tier(digest)) == "premium"
+    assert asyncio.run(workers[1].api_key_tier(api_key_digest("ak-dev-test-1a1b2c3d.unknown"))) is None
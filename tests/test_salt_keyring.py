@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+from utils.salt_keyring import SaltKeyring
+
+
+def make_keyring(min_reload_interval:float, rows:list) -> SaltKeyring:
+    keyring = SaltKeyring(min_reload_interval=min_reload_interval)
+    keyring.reloads = 0
+
+    async def refresh():
+        keyring.reloads += 1
+        await asyncio.sleep(0.01)
+        keyring.load(rows)
+
+    keyring.refresh = refresh
+    return keyring
+
+
+def salt_row(version_id:str) -> SimpleNamespace:
+    return SimpleNamespace(version_id=version_id, version_name=f"name-{version_id}", key_value="salt", is_deprecated=False)
+
+
+def test_concurrent_misses_share_one_reload():
+    keyring = make_keyring(60, [salt_row("v2")])
+
+    async def scenario():
+        return await asyncio.gather(*(keyring.resolve(version_id="v2") for _ in range(20)))
+
+    entries = asyncio.run(scenario())
+    assert all(entry is not None and entry.version_id == "v2" for entry in entries)
+    assert keyring.reloads == 1
+
+
+def test_unknown_versions_reload_at_most_once_per_interval():
+    keyring = make_keyring(60, [])
+
+    async def scenario():
+        first = await keyring.resolve(version_id="missing")
+        # later misses within the interval, for any version, are answered without a reload
+        others = [await keyring.resolve(version_id=f"missing-{i}") for i in range(10)]
+        return [first] + others
+
+    assert asyncio.run(scenario()) == [None] * 11
+    assert keyring.reloads == 1
+
+
+def test_reload_failure_resolves_to_none():
+    keyring = SaltKeyring()
+
+    async def refresh():
+        raise ConnectionError("database is down")
+
+    keyring.refresh = refresh
+    assert asyncio.run(keyring.resolve(version_id="v1")) is None
@@ -0,0 +1,28 @@
+import subprocess
+import sys
+import time
+from conftest import SRC_DIR
+from utils.startup import StartupTimer
+
+
+def test_importing_the_app_modules_does_not_build_the_engine():
+    # a fresh interpreter, other tests in this process may already have built the engine
+    check = "import main, models; assert models._engine is None and models._sessionlocal is None"
+    result = subprocess.run([sys.executable, "-c", check], cwd=SRC_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_timer_counts_the_imports_before_the_lifespan():
+    started_at = time.perf_counter() - 0.25
+    timer = StartupTimer(started_at)
+    timer.mark("redis")
+    report = timer.report()
+    assert list(report["phases"]) == ["imports", "redis"]
+    assert report["phases"]["imports"] >= 250
+    assert report["total_ms"] >= report["phases"]["imports"] + report["phases"]["redis"] - 0.2
+
+
+def test_timer_without_start_time_begins_at_the_lifespan():
+    timer = StartupTimer()
+    timer.mark("redis")
+    assert list(timer.report()["phases"]) == ["redis"]